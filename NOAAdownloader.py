@@ -32,6 +32,9 @@
 # USE:
 # Simply call this script, with the optional argument --verbose if you want
 # debug output. It will prompt you for everything else it needs interactively.
+# --metrics FILE writes progress and a summary as JSON lines, with the time
+# spent downloading, parsing and waiting between downloads, and --profile FILE
+# saves cProfile stats: see instrumentation.py.
 
 # TODO short term: decompose further. Specifically:
 #		make parse_row_NOAA that handles all the format-specific stuff
@@ -47,6 +50,7 @@
 # TODO for scraperwiki: have it load in the whole list of stations and just
 #		iterate over them.
 
+import argparse
 import datetime
 import urllib
 import os
@@ -55,12 +59,16 @@ import time
 import csv
 import sys
 
+import instrumentation # --metrics and --profile
+
 
 
 # This function goes through each downloaded file line by line, and translates
 #		it from NOAA's idiosyncratic format to CSV with all the fields separated
 #		out rationally.
-def parsefile(f_in, f_out, stationname, verbose):
+def parsefile(f_in, f_out, stationname, verbose, metrics=None):
+	if metrics is None:
+		metrics = instrumentation.Metrics("NOAAdownloader")
 	# Set up connections to input and output files. The CSV library also helps
 	#		with reading the input file, because we can treat it as space separated
 	#		with consecutive spaces being collapsed together
@@ -167,6 +175,7 @@ def parsefile(f_in, f_out, stationname, verbose):
 
 			# And we're done!  Now write the row to the output file
 			writer.writerow(outrow)
+			metrics.add("rows")
 	if verbose:
 		sys.stdout.write("parsed.\n")
 	else:
@@ -178,7 +187,9 @@ def parsefile(f_in, f_out, stationname, verbose):
 # This is the main control function. Each pass gets the user's input to pick a
 #		station, and then loops over years to download the relevant files, calling
 #		parsefile() to parse each one into standard CSV
-def downloadfiles(maxyears, verbose):
+def downloadfiles(maxyears, verbose, metrics=None):
+	if metrics is None:
+		metrics = instrumentation.Metrics("NOAAdownloader")
 	# get parameters for and start constructing filenames
 	URLroot = "ftp://ftp.ncdc.noaa.gov/pub/data/gsod/" # base URL for all files
 	filesuffix = ".op.gz" # suffix for all the raw files
@@ -210,14 +221,18 @@ def downloadfiles(maxyears, verbose):
 
 		# Now we try to download the file, with very basic error handling if verbose
 		try:
-			urllib.urlretrieve(fullURL,str(year)+filesuffix)
+			with metrics.stage("download"):
+				urllib.urlretrieve(fullURL,str(year)+filesuffix)
 			if verbose: sys.stdout.write("retrieved ... ")
 			yearsdownloaded += 1
+			metrics.add("years")
+			metrics.add_file_size("download_bytes", str(year)+filesuffix)
 		except IOError as e:
 			if verbose: print(" ")
 			print(e)
 		else: # if we got the file without any errors, then
-			# uncompress the file
+			# uncompress the file (gzip actually decompresses it as it's read, so
+			#		that time is part of the parse stage)
 			f_in = gzip.open(str(year)+filesuffix)
 			if verbose: sys.stdout.write("decompressed ... ")
 			# and start writing the output
@@ -234,16 +249,18 @@ def downloadfiles(maxyears, verbose):
 					"NPrecipReportHours", "PrecipFlag", "SnowDepth", "Fog", "Rain", \
 					"Snow", "Hail", "Thunder", "Tornado"])
 			# This function does the actual ETL
-			parsefile(f_in, f_out, stationname, verbose)
+			with metrics.stage("parse"):
+				parsefile(f_in, f_out, stationname, verbose, metrics)
 			# clean up after ourselves
 			f_in.close()
 			os.remove(str(year)+filesuffix)
 		urllib.urlcleanup()
-		if yearsdownloaded == maxyears:
-			break # if we have enough years, then end this loop
-		else:
-			time.sleep(5) # slow down here to stop the server locking us out
-		time.sleep(1)
+		with metrics.stage("wait"):
+			if yearsdownloaded == maxyears:
+				break # if we have enough years, then end this loop
+			else:
+				time.sleep(5) # slow down here to stop the server locking us out
+			time.sleep(1)
 	print("Successfully downloaded " + str(yearsdownloaded) + " years between " +
 		str(year) + " and " + str(firstyear) + " for station " + stationname)
 	if yearsdownloaded < maxyears:
@@ -252,33 +269,37 @@ def downloadfiles(maxyears, verbose):
 	f_out.close()
 
 
-def main (args):
+def main (argv):
 	# Check for --verbose argument. You'll get more feedback if you use this.
-	if len(args) == 0:
-		# then default to non-verbose
-		verbose = False
-	elif args[0] == "--verbose":
-		verbose = True
-	else:
-		verbose = False
-
-	# I've assumed you'll want the same number of years for every station you
-	#		download in one session, so we ask this before going into the main loop.
-	maxyears = int(raw_input("How many years of data would you like to download " \
-		"for each station?\n"))
-
-	# This is the main control loop. It repeatedly asks the user for station codes
-	#		and calls downloadfiles() to download the requested data, until it's told
-	#		to stop.
-	goagain = "Y"
-	while not (goagain.startswith('N') or goagain.startswith('n')):
-		downloadfiles(maxyears, verbose)
-		goagain = raw_input("Would you like to download another station (Y/N)?\n")
-		while not (goagain.startswith('N') or goagain.startswith('n') or
-			goagain.startswith('y') or goagain.startswith('Y')):
-			goagain = raw_input("Please help me, I am but a stupid computer. " \
-				"I can only understand Y or N as responses to this prompt. "
-				"Would you like to download another station (Y/N)?\n")
+	args = get_args(argv)
+	verbose = args.verbose
+
+	with instrumentation.run("NOAAdownloader", args) as metrics:
+		# I've assumed you'll want the same number of years for every station you
+		#		download in one session, so we ask this before going into the main loop.
+		maxyears = int(raw_input("How many years of data would you like to download " \
+			"for each station?\n"))
+
+		# This is the main control loop. It repeatedly asks the user for station codes
+		#		and calls downloadfiles() to download the requested data, until it's told
+		#		to stop.
+		goagain = "Y"
+		while not (goagain.startswith('N') or goagain.startswith('n')):
+			downloadfiles(maxyears, verbose, metrics)
+			metrics.add("stations")
+			goagain = raw_input("Would you like to download another station (Y/N)?\n")
+			while not (goagain.startswith('N') or goagain.startswith('n') or
+				goagain.startswith('y') or goagain.startswith('Y')):
+				goagain = raw_input("Please help me, I am but a stupid computer. " \
+					"I can only understand Y or N as responses to this prompt. "
+					"Would you like to download another station (Y/N)?\n")
 	return 0
 
+
+def get_args(argv):
+	parser = argparse.ArgumentParser(description="Download NOAA historical weather data for one or more stations, as CSV.")
+	parser.add_argument("--verbose", help="print debug output as we go.", action="store_true")
+	instrumentation.add_arguments(parser)
+	return parser.parse_args(argv)
+
 if __name__ == '__main__': sys.exit(main(sys.argv[1:]))
@@ -15,9 +15,22 @@ aggregated by date:
 
 Non-numeric entries are simply dropped.
 
+Either file can be compressed (.gz, .bz2, .xz or .zst): see compressed_io.py.
+Runs in Python 2 or Python 3; in Python 3 files are read and written as UTF-8.
+
 Note that it attempts to sort the output data, but only does so lexically.
 This works poorly for non-ISO format dates.
 
+Alternatively, the column to aggregate by can be derived on the fly from an
+ISO 8601 timestamp column, with --derive hour, weekday, month, date or Nmin
+(e.g. 15min, for 15 minute buckets through the day). These are output in
+chronological order. To get an "average day" straight from raw timestamps:
+	./aggregate_csv.py inputfile outputfile timestampcolumn --derive 15min
+
+To see where the time goes in a long run, --metrics FILE writes progress and a
+summary as JSON lines, and --profile FILE saves cProfile stats: see
+instrumentation.py.
+
 IMPORTANT: because this aggregates with a simple mean, outliers in the source
 data can skew averages terribly. Make sure you first clean up outliers and any
 weird NULL placeholders in your dataset.
@@ -25,64 +38,174 @@ weird NULL placeholders in your dataset.
 
 import argparse
 import copy
-import unicodecsv as csv # unicode-aware replacement for the standard Python csv module. pip install unicodecsv. https://github.com/jdunck/python-unicodecsv
-import os
+import datetime
 import sys
 import time
 
+import fast_csv # shared with the other scripts here; fast CSV reading and writing, compressed or not (via compressed_io.py)
+import instrumentation # also shared; --metrics and --profile
+
 
 
 
 def main():
 	args = get_args()
 	print_with_timestamp("Starting run.")
-	with open(args.input_file, 'rU') as infile:
-		with open(args.output_file, 'w') as outfile:
-			aggregate(infile, outfile, args.aggregate_across, args.aggregate_by)
+	with instrumentation.run("aggregate_csv", args) as metrics:
+		with fast_csv.open_file(args.input_file) as infile:
+			with fast_csv.open_file(args.output_file, 'w') as outfile:
+				aggregate(infile, outfile, args.aggregate_across, args.aggregate_by, args.derive, metrics)
+		metrics.add_file_size("input_bytes", args.input_file)
+		metrics.add_file_size("output_bytes", args.output_file)
 	print_with_timestamp("Run complete.")
 
 
 
 
-def aggregate(infile, outfile, agg_across, agg_by):
-	reader = csv.DictReader(infile)
+def aggregate(infile, outfile, agg_across, agg_by, derive=None, metrics=None):
+	if metrics is None:
+		metrics = instrumentation.Metrics("aggregate_csv")
+	reader = fast_csv.DictReader(infile)
 	output_fieldnames = copy.deepcopy(reader.fieldnames)
 	output_fieldnames.remove(agg_across)
-	writer = csv.DictWriter(outfile, fieldnames=output_fieldnames)
+	if derive is not None:
+		group_key = make_time_bucketer(derive)
+		key_field = agg_by + "_" + derive
+		# the derived column takes the place of agg_by, or of agg_across if they're the same column
+		if agg_by in output_fieldnames:
+			output_fieldnames[output_fieldnames.index(agg_by)] = key_field
+		else:
+			output_fieldnames.insert(reader.fieldnames.index(agg_by), key_field)
+	else:
+		key_field = agg_by
+	value_fields = [field for field in output_fieldnames if field != key_field or derive is None]
+	writer = fast_csv.DictWriter(outfile, fieldnames=output_fieldnames)
 	writer.writeheader()
 
-# First step through finding all agg_by values
-	agg_by_keys = []
-	for row in reader:
-		if row[agg_by] not in agg_by_keys:
-			agg_by_keys.append(row[agg_by])
-
-# Then make the dict of dicts that will store interim data
+# Step through the reader once, sorting and counting values into a dict of dicts keyed by agg_by value (or its derived time bucket)
 	data_frame = {}
-	for key in agg_by_keys:
-		data_frame[key] = {}
-		for field in output_fieldnames:
-			data_frame[key][field] = {}
-			data_frame[key][field]['count'] = 0
-			data_frame[key][field]['sum'] = 0
-
-# Now step through the reader again, sorting and counting values
-	infile.seek(0)
-	for row in reader:
-		for field in row:
-			if row[field]!= None and is_number(row[field]):
-				data_frame[row[agg_by]][field]['count'] += 1
-				data_frame[row[agg_by]][field]['sum'] += float(row[field])
+	sort_keys = {}
+	unparseable = 0
+	with metrics.stage("parse"):
+		for row in reader:
+			metrics.add("rows")
+			if derive is not None:
+				bucket = group_key(row[agg_by])
+				if bucket is None:
+					unparseable += 1
+					continue
+				sort_keys[bucket[1]] = bucket[0]
+				key = bucket[1]
+			else:
+				key = row[agg_by]
+			if key not in data_frame:
+				data_frame[key] = {}
+				for field in value_fields:
+					data_frame[key][field] = {'count': 0, 'sum': 0}
+			for field in value_fields:
+				if row[field]!= None and is_number(row[field]):
+					data_frame[key][field]['count'] += 1
+					data_frame[key][field]['sum'] += float(row[field])
+	if unparseable > 0:
+		print_with_timestamp(str(unparseable) + " row[s] skipped because their " + agg_by + " couldn't be read as a timestamp.")
 
 # Now step through data_frame averaging as appropriate and write that to outfile
-	for key in sorted(data_frame.keys()):
-		outrow = {agg_by: key}
-		for field in data_frame[key]:
-			if data_frame[key][field]['count'] == 1:
-				outrow[field] = data_frame[key][field]['sum']
-			elif data_frame[key][field]['count'] > 1:
-				outrow[field] = data_frame[key][field]['sum'] / data_frame[key][field]['count']
-		writer.writerow(outrow)
+# Derived time buckets go in chronological order; anything else is only sorted lexically
+	if derive is not None:
+		keys = sorted(data_frame.keys(), key=lambda k: sort_keys[k])
+	else:
+		# rows too short to have an agg_by value are grouped under None, which goes first, as Python 2 sorts it
+		keys = sorted(data_frame.keys(), key=lambda k: (k is not None, k))
+	with metrics.stage("write"):
+		for key in keys:
+			outrow = {key_field: key}
+			for field in data_frame[key]:
+				if data_frame[key][field]['count'] == 1:
+					outrow[field] = data_frame[key][field]['sum']
+				elif data_frame[key][field]['count'] > 1:
+					outrow[field] = data_frame[key][field]['sum'] / data_frame[key][field]['count']
+			writer.writerow(outrow)
+
+
+
+
+weekdays = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Returns a function that takes a timestamp string and returns (sort key, bucket label) for it, or None if it can't be read.
+# Timestamps are read by slicing them as fixed-format ISO 8601: YYYY-MM-DD, then for hour and Nmin buckets a time from the 12th character, HH:MM
+# (the separator between date and time can be anything, so "2015-04-01 13:45:00" and "2015-04-01T13:45" both work).
+# date and weekday need a real date; month and the time of day buckets only need the year, month and day to be numbers.
+# Each bucket only depends on either the date or the time of day, and a time series only has a few distinct ones of those, so each is only read once.
+# Memoising on just that part rather than the whole timestamp keeps the memo small however many rows there are.
+# For hour and Nmin the date part is checked separately, with a memo of its own, so that the memo doesn't grow with days times times of day.
+def make_time_bucketer(derive):
+	if derive.endswith("min"):
+		minutes = int(derive[:-3])
+	buckets = {}
+	numeric_dates = {}
+	def time_bucket(timestamp):
+		if not isinstance(timestamp, str):
+			return None # a short row has None here
+		if derive in ["date", "weekday", "month"]:
+			part = timestamp[0:10]
+		elif len(timestamp) >= 16:
+			if timestamp[0:10] not in numeric_dates:
+				numeric_dates[timestamp[0:10]] = read_date_numbers(timestamp[0:10]) is not None
+			if not numeric_dates[timestamp[0:10]]:
+				return None
+			part = timestamp[11:16]
+		else:
+			return None
+		if part not in buckets:
+			try:
+				if derive in ["date", "weekday", "month"]:
+					numbers = read_date_numbers(part)
+					if numbers is None:
+						raise ValueError
+					year, month, day = numbers
+					if derive == "month":
+						if month < 1 or month > 12:
+							raise ValueError
+						buckets[part] = (month, "%02d" % month)
+					else:
+						date = datetime.date(year, month, day) # also checks it's a real date
+						if derive == "date":
+							buckets[part] = ((year, month, day), date.isoformat())
+						else:
+							buckets[part] = (date.weekday(), weekdays[date.weekday()])
+				else:
+					hour = int(part[0:2])
+					minute = int(part[3:5])
+					if hour > 23 or minute > 59:
+						raise ValueError
+					if derive == "hour":
+						buckets[part] = (hour, "%02d" % hour)
+					else:
+						start = (hour * 60 + minute) // minutes * minutes
+						buckets[part] = (start, "%02d:%02d" % (start // 60, start % 60))
+			except ValueError:
+				buckets[part] = None
+		return buckets[part]
+	return time_bucket
+
+
+
+# Returns (year, month, day) from a YYYY-MM-DD string, or None if they aren't all numbers
+def read_date_numbers(part):
+	try:
+		return int(part[0:4]), int(part[5:7]), int(part[8:10])
+	except ValueError:
+		return None
+
+
+
+# argparse type for --derive
+def time_bucket_name(name):
+	if name in ["hour", "weekday", "month", "date"]:
+		return name
+	elif name.endswith("min") and name[:-3].isdigit() and int(name[:-3]) > 0:
+		return name
+	raise argparse.ArgumentTypeError("'" + name + "' isn't one of hour, weekday, month, date, or a number of minutes like 15min")
 
 
 
@@ -99,7 +222,7 @@ def is_number(s):
 
 
 def print_with_timestamp(msg):
-	print time.ctime() + ": " + msg
+	print(time.ctime() + ": " + msg)
 	sys.stdout.flush() # explicitly flushing stdout makes sure that a .out file stays up to date - otherwise it can be hard to keep track of whether a background job is hanging
 
 
@@ -111,15 +234,21 @@ def get_args():
 	parser.add_argument("input_file", help="required argument: the file we'll be cleaning.")
 	parser.add_argument("output_file", help="required argument: the file we'll be saving cleaned data into. If this file already exists it will be overwritten.")
 	parser.add_argument("aggregate_across", help="required argument: the name of the column that we will be aggregating across.")
-	parser.add_argument("aggregate_by", help="required argument: the name of the column that we will be aggregating by.")
+	parser.add_argument("aggregate_by", help="the name of the column that we will be aggregating by. Required unless --derive is used, in which case it defaults to aggregate_across.", nargs='?')
 
-# optional argument
+# optional arguments
+	parser.add_argument("-d", "--derive", help="aggregate by a time bucket of the timestamps in aggregate_by, rather than by its exact values: hour (of the day), weekday, month (of the year), date, or a number of minutes into the day like 15min. Output is in chronological order, under a column named after aggregate_by and the bucket, e.g. timestamp_hour.", type=time_bucket_name)
+	instrumentation.add_arguments(parser)
 #	parser.add_argument("-s", "--separator", help="the character that separates values within the out of range column. Default is ';'.", nargs='?', default=';')
 
-	return parser.parse_args()
+	args = parser.parse_args()
+	if args.aggregate_by is None:
+		if args.derive is None:
+			parser.error("aggregate_by is required unless --derive is used")
+		args.aggregate_by = args.aggregate_across
+	return args
 
 
 
 if __name__ == "__main__":
-	sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 	main()
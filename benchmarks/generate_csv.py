@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+
+# Synthetic CSV generator, for benchmarking aggregate_csv.py and
+# clear_out_of_range.py on realistic sizes and shapes of data.
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+# Two kinds of file:
+#	aggregate: timestamp, group, value1 ... valueN
+#		One row a minute from 2015-01-01 00:00, in one of --groups groups.
+#		For example: ./aggregate_csv.py in.csv out.csv timestamp group
+#	out_of_range: timestamp, value1 ... valueN, flags
+#		flags lists the value columns flagged as out of range in that row,
+#		separated by semicolons, each with probability --flag-density.
+#		For example: ./clear_out_of_range.py in.csv out.csv flags
+# In both, a --non-numeric share of the value cells hold "NA" rather than a
+# number.
+#
+# Making random numbers cell by cell would take longer than the tools being
+# benchmarked, so the value cells of each row are picked from a pool of
+# pool_size rows made up in advance. The tools still have to parse and handle
+# every cell, so this makes no difference to what's being measured.
+#
+# Usage: generate_csv.py aggregate 1M aggregate_1M.csv
+# Output can be compressed by giving it a .gz, .bz2, .xz or .zst extension.
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import compressed_io	# shared with the scripts in the parent directory
+
+
+pool_size = 4096
+kinds = ["aggregate", "out_of_range"]
+
+
+
+
+def main():
+	args = get_args()
+	print_with_timestamp("Writing " + str(args.rows) + " rows to " + args.output_file)
+	starttime = time.time()
+	generate(
+			args.kind, args.output_file, args.rows, args.columns, args.groups,
+			args.non_numeric, args.flag_density, args.seed
+	)
+	print_with_timestamp("Done in " + str(round(time.time() - starttime, 1)) + " seconds.")
+
+
+
+
+def generate(kind, filename, rows, columns=10, groups=100, non_numeric=0.05, flag_density=0.01, seed=1):
+	rng = random.Random(seed)
+	value_names = ["value" + str(i) for i in range(1, columns + 1)]
+	if kind == "aggregate":
+		header = ["timestamp", "group"] + value_names
+	else:
+		header = ["timestamp"] + value_names + ["flags"]
+	pool = [make_values(rng, value_names, kind, non_numeric, flag_density) for i in range(0, pool_size)]
+	group_names = ["g" + str(i) for i in range(0, groups)]
+	times = ["%02d:%02d" % (minute // 60, minute % 60) for minute in range(0, 1440)]
+	day = datetime.date(2015, 1, 1)
+
+	with compressed_io.open_file(filename, 'wb') as outfile:
+		outfile.write((",".join(header) + "\n").encode("ascii"))
+		lines = []
+		for row in range(0, rows):
+			minute = row % 1440
+			if minute == 0 and row > 0:
+				day += datetime.timedelta(days=1)
+			timestamp = day.isoformat() + " " + times[minute]
+			if kind == "aggregate":
+				lines.append(timestamp + "," + group_names[rng.randrange(groups)] + "," + pool[rng.randrange(pool_size)])
+			else:
+				lines.append(timestamp + "," + pool[rng.randrange(pool_size)])
+			if len(lines) == 10000:
+				outfile.write(("\n".join(lines) + "\n").encode("ascii"))
+				lines = []
+		if len(lines) > 0:
+			outfile.write(("\n".join(lines) + "\n").encode("ascii"))
+
+
+
+# One pooled row's worth of value cells (plus flags, for out_of_range), as a
+# single comma-separated string
+def make_values(rng, value_names, kind, non_numeric, flag_density):
+	values = []
+	for name in value_names:
+		if rng.random() < non_numeric:
+			values.append("NA")
+		else:
+			values.append("%.2f" % (rng.random() * 100))
+	if kind == "out_of_range":
+		values.append(";".join(name for name in value_names if rng.random() < flag_density))
+	return ",".join(values)
+
+
+
+# Reads 1000, 10K, 1M, 100M etc
+def row_count(text):
+	multipliers = {'K': 1000, 'M': 1000000}
+	text = text.upper()
+	try:
+		if text[-1:] in multipliers:
+			return int(float(text[:-1]) * multipliers[text[-1]])
+		return int(text)
+	except ValueError:
+		raise argparse.ArgumentTypeError("'" + text + "' isn't a number of rows like 5000, 10K or 1M")
+
+
+
+def print_with_timestamp(msg):
+	print(time.ctime() + ": " + msg)
+	sys.stdout.flush()
+
+
+
+def get_args():
+	parser = argparse.ArgumentParser(description="Generate synthetic CSVs for benchmarking aggregate_csv.py and clear_out_of_range.py.")
+
+# positional arguments
+	parser.add_argument("kind", help="required argument: aggregate or out_of_range.", choices=kinds)
+	parser.add_argument("rows", help="required argument: number of data rows, e.g. 5000, 10K or 1M.", type=row_count)
+	parser.add_argument("output_file", help="required argument: the file to write. If this file already exists it will be overwritten.")
+
+# optional arguments
+	parser.add_argument("-c", "--columns", help="number of value columns. Default is 10.", type=int, default=10)
+	parser.add_argument("-g", "--groups", help="number of distinct values in the group column (aggregate only). Default is 100.", type=int, default=100)
+	parser.add_argument("-n", "--non-numeric", help="share of value cells that aren't numbers. Default is 0.05.", type=float, default=0.05)
+	parser.add_argument("-f", "--flag-density", help="chance of each value being flagged as out of range (out_of_range only). Default is 0.01.", type=float, default=0.01)
+	parser.add_argument("-s", "--seed", help="random seed, so the same options always make the same file. Default is 1.", type=int, default=1)
+
+	return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+	main()
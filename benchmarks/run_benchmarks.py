@@ -0,0 +1,244 @@
+#! /usr/bin/env python
+
+# Benchmark runner for aggregate_csv.py and clear_out_of_range.py
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+# Runs each benchmark case on synthetic data from generate_csv.py, at each
+# of the row counts asked for, and reports rows/second, MB/second of input
+# and the peak memory (RSS) of the tool's process. Data files are generated
+# the first time they're needed and kept in --data-dir for later runs.
+#
+# Results are saved as JSON. If there's a baseline results file, each result
+# is compared against the matching one in it, and anything slower or bigger
+# than the baseline by more than --tolerance is flagged as a regression (and
+# the runner exits with status 1). So the usual loop is:
+#	./run_benchmarks.py --save-baseline				# before a change
+#	./run_benchmarks.py								# after it
+# Use --rows 1M 10M 100M for the full range of sizes; the default is 1M.
+#
+# The tools are run as separate processes, with the Python running this
+# script unless --python says otherwise, so they can be timed and measured
+# in isolation. Measuring needs os.wait4(), so this only runs on Unix-like
+# systems.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate_csv
+
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+tools_dir = os.path.dirname(benchmarks_dir)
+
+# Each case runs one tool on one kind of generate_csv.py data. "{input}" and
+# "{output}" in the command are filled in for each run.
+cases = {
+	'aggregate': {
+		'kind': "aggregate",
+		'command': ["aggregate_csv.py", "{input}", "{output}", "timestamp", "group"]
+	},
+	'aggregate_derive': {
+		'kind': "aggregate",
+		'command': ["aggregate_csv.py", "{input}", "{output}", "timestamp", "--derive", "15min"]
+	},
+	'clear_out_of_range': {
+		'kind': "out_of_range",
+		'command': ["clear_out_of_range.py", "{input}", "{output}", "flags"]
+	}
+}
+
+# Data parameters that go into each result, and must match for two results
+# to be compared
+data_params = ["rows", "columns", "groups", "non_numeric", "flag_density"]
+
+
+
+
+def main():
+	args = get_args()
+	if not os.path.isdir(args.data_dir):
+		os.makedirs(args.data_dir)
+
+	results = []
+	for case in args.cases:
+		for rows in args.rows:
+			params = {
+				'rows': rows,
+				'columns': args.columns,
+				'groups': args.groups,
+				'non_numeric': args.non_numeric,
+				'flag_density': args.flag_density
+			}
+			inputfile = data_file(args.data_dir, cases[case]['kind'], params)
+			print_with_timestamp("Running " + case + " on " + str(rows) + " rows.")
+			result = run_case(case, inputfile, rows, args.python, args.repeat)
+			result.update(params)
+			results.append(result)
+			print(
+					"\t" + format_number(result['rows_per_sec']) + " rows/s, "
+					+ format_number(result['mb_per_sec']) + " MB/s, peak RSS "
+					+ format_number(result['peak_rss_mb']) + " MB"
+			)
+
+	report = {
+		'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+		'python': subprocess.check_output([args.python, "-c", "import sys; print(sys.version.split()[0])"]).decode("ascii").strip(),
+		'platform': platform.platform(),
+		'results': results
+	}
+	write_json(args.results, report)
+	print_with_timestamp("Results saved to " + args.results)
+
+	if args.save_baseline:
+		write_json(args.baseline, report)
+		print_with_timestamp("Results saved as the new baseline in " + args.baseline)
+	elif os.path.isfile(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		regressions = find_regressions(results, baseline['results'], args.tolerance)
+		if len(regressions) > 0:
+			print_with_timestamp("Regressions against the baseline in " + args.baseline + ":")
+			for line in regressions:
+				print("\t" + line)
+			sys.exit(1)
+		print_with_timestamp("No regressions against the baseline in " + args.baseline + ".")
+
+
+
+
+# Generates the data for a case if it isn't already in data_dir. This runs
+# generate_csv.py as a separate process: Linux counts the runner's own peak RSS
+# in each tool's ru_maxrss (it's carried over when the tool's process starts),
+# so generating a big file in here would make every tool look bigger.
+def data_file(data_dir, kind, params):
+	filename = os.path.join(
+			data_dir,
+			kind + "_" + "_".join(str(params[p]) for p in data_params) + ".csv"
+	)
+	if not os.path.isfile(filename):
+		print_with_timestamp("Generating " + filename)
+		with open(os.devnull, 'w') as devnull:
+			subprocess.check_call([
+					sys.executable, os.path.join(benchmarks_dir, "generate_csv.py"),
+					kind, str(params['rows']), filename + ".partial",
+					"--columns", str(params['columns']),
+					"--groups", str(params['groups']),
+					"--non-numeric", str(params['non_numeric']),
+					"--flag-density", str(params['flag_density'])
+			], stdout=devnull)
+		os.rename(filename + ".partial", filename)
+	return filename
+
+
+
+# Runs a case repeat times and keeps the fastest run, along with the highest
+# peak RSS of any run
+def run_case(case, inputfile, rows, python, repeat):
+	outputdir = tempfile.mkdtemp()
+	outputfile = os.path.join(outputdir, "output.csv")
+	command = [python, os.path.join(tools_dir, cases[case]['command'][0])]
+	for arg in cases[case]['command'][1:]:
+		command.append(arg.replace("{input}", inputfile).replace("{output}", outputfile))
+	seconds = None
+	peak_rss = 0
+	try:
+		for i in range(0, repeat):
+			with open(os.devnull, 'w') as devnull:
+				starttime = time.time()
+				process = subprocess.Popen(command, stdout=devnull)
+				pid, status, usage = os.wait4(process.pid, 0)
+				elapsed = time.time() - starttime
+			if status != 0:
+				raise RuntimeError(" ".join(command) + " failed with status " + str(status))
+			if seconds is None or elapsed < seconds:
+				seconds = elapsed
+			peak_rss = max(peak_rss, usage.ru_maxrss)
+	finally:
+		if os.path.exists(outputfile):
+			os.remove(outputfile)
+		os.rmdir(outputdir)
+	if sys.platform != "darwin":
+		peak_rss *= 1024 # Linux reports ru_maxrss in KB, macOS in bytes
+	megabytes = os.path.getsize(inputfile) / 1e6
+	return {
+		'case': case,
+		'seconds': round(seconds, 3),
+		'rows_per_sec': round(rows / seconds, 1),
+		'mb_per_sec': round(megabytes / seconds, 3),
+		'peak_rss_mb': round(peak_rss / 1e6, 1),
+		'input_mb': round(megabytes, 1)
+	}
+
+
+
+# Compares each result with the baseline result for the same case and data,
+# if there is one. Returns a description of each regression found.
+def find_regressions(results, baseline_results, tolerance):
+	regressions = []
+	for result in results:
+		for base in baseline_results:
+			if base['case'] == result['case'] and all(base.get(p) == result[p] for p in data_params):
+				name = result['case'] + " at " + str(result['rows']) + " rows: "
+				if result['rows_per_sec'] < base['rows_per_sec'] * (1 - tolerance):
+					regressions.append(
+							name + format_number(result['rows_per_sec']) + " rows/s, down from "
+							+ format_number(base['rows_per_sec'])
+					)
+				if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+					regressions.append(
+							name + "peak RSS " + format_number(result['peak_rss_mb']) + " MB, up from "
+							+ format_number(base['peak_rss_mb'])
+					)
+	return regressions
+
+
+
+def write_json(filename, data):
+	with open(filename, 'w') as f:
+		json.dump(data, f, indent=1, sort_keys=True)
+
+
+
+def format_number(n):
+	return "{:,.1f}".format(n)
+
+
+
+def print_with_timestamp(msg):
+	print(time.ctime() + ": " + msg)
+	sys.stdout.flush()
+
+
+
+def get_args():
+	parser = argparse.ArgumentParser(description="Benchmark aggregate_csv.py and clear_out_of_range.py on synthetic data.")
+
+# optional arguments
+	parser.add_argument("--cases", help="benchmark cases to run. Default is all of them.", nargs="+", choices=sorted(cases.keys()), default=sorted(cases.keys()))
+	parser.add_argument("-r", "--rows", help="row counts to run each case at, e.g. 1M 10M 100M. Default is 1M.", nargs="+", type=generate_csv.row_count, default=[1000000])
+	parser.add_argument("-c", "--columns", help="number of value columns in the data. Default is 10.", type=int, default=10)
+	parser.add_argument("-g", "--groups", help="number of distinct groups in the aggregate data. Default is 100.", type=int, default=100)
+	parser.add_argument("-n", "--non-numeric", help="share of value cells that aren't numbers. Default is 0.05.", type=float, default=0.05)
+	parser.add_argument("-f", "--flag-density", help="chance of each value being flagged as out of range. Default is 0.01.", type=float, default=0.01)
+	parser.add_argument("--repeat", help="number of times to run each case; the fastest run counts. Default is 1.", type=int, default=1)
+	parser.add_argument("--python", help="Python interpreter to run the tools with. Default is the one running this script.", default=sys.executable)
+	parser.add_argument("--data-dir", help="where to keep generated data. Default is data/ in this directory.", default=os.path.join(benchmarks_dir, "data"))
+	parser.add_argument("--results", help="file to save results to. Default is results.json in this directory.", default=os.path.join(benchmarks_dir, "results.json"))
+	parser.add_argument("--baseline", help="baseline results file to compare against. Default is baseline.json in this directory.", default=os.path.join(benchmarks_dir, "baseline.json"))
+	parser.add_argument("--save-baseline", help="save these results as the new baseline instead of comparing against the old one.", action="store_true")
+	parser.add_argument("--tolerance", help="how much slower or bigger than the baseline a result can be before it counts as a regression. Default is 0.1, i.e. 10%%.", type=float, default=0.1)
+
+	return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+	main()
@@ -14,11 +14,16 @@ CONTEXT:
 	with a designated "out of range" column, and NULLs every value flagged in that
 	column.
 ASSUMPTIONS:
-	* CSV starts with a single header row
+	* CSV starts with a single header row. It, and the output, can be compressed
+		(.gz, .bz2, .xz or .zst): see compressed_io.py
+	* In Python 3 (Python 2 works too), files are UTF-8
 	* There is a column that for any given row, flags those values considered out
 		of range in it.
 	* The column names are exactly consistent between the header row and their
 		references in the out of range column
+METRICS:
+	--metrics FILE writes progress and a summary as JSON lines, and --profile
+	FILE saves cProfile stats: see instrumentation.py
 TESTING:
 	I am making this to clean data from https://green2.kingcounty.gov/marine-buoy/
 	At present, this is the only file I've tested it on, with some manual
@@ -26,58 +31,67 @@ TESTING:
 '''
 
 import argparse
-import unicodecsv as csv # unicode-aware replacement for the standard Python csv module. pip install unicodecsv. https://github.com/jdunck/python-unicodecsv
-import os
 import sys
 import time
 
+import fast_csv # shared with the other scripts here; fast CSV reading and writing, compressed or not (via compressed_io.py)
+import instrumentation # also shared; --metrics and --profile
+
 
 
 
 def main():
 	args = get_args()
 	print_with_timestamp("Starting run.")
-	with open(args.input_file, 'rU') as infile:
-		with open(args.output_file, 'w') as outfile:
-			clean_file(infile, outfile, args.flag_col, args.separator)
+	with instrumentation.run("clear_out_of_range", args) as metrics:
+		with fast_csv.open_file(args.input_file) as infile:
+			with fast_csv.open_file(args.output_file, 'w') as outfile:
+				clean_file(infile, outfile, args.flag_col, args.separator, metrics)
+		metrics.add_file_size("input_bytes", args.input_file)
+		metrics.add_file_size("output_bytes", args.output_file)
 	print_with_timestamp("Run complete.")
 
 
 
 
-def clean_file(infile, outfile, flag_col, separator):
-	reader = csv.DictReader(infile)
-	writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+# Reading, cleaning and writing all happen row by row, so they're timed together as one "clean" stage
+def clean_file(infile, outfile, flag_col, separator, metrics=None):
+	if metrics is None:
+		metrics = instrumentation.Metrics("clear_out_of_range")
+	reader = fast_csv.DictReader(infile)
+	writer = fast_csv.DictWriter(outfile, fieldnames=reader.fieldnames)
 	writer.writeheader()
 	replacements = {}
 	unreplaceables = {}
-	for row in reader:
-		if row[flag_col] != None and row[flag_col] != '':
-			for colname in row[flag_col].split(separator):
-				if colname != None and colname != '' and colname != ' ':
-					if colname in reader.fieldnames:
-						row[colname] = None
-						if colname in replacements.keys():
-							replacements[colname] = replacements[colname] + 1
-						else:
-							replacements[colname] = 1
-					else:
-						print "Column mismatch: '"+colname+"'\tlisted in '"+flag_col+"' but not present in headers."
-						if colname in unreplaceables.keys():
-							unreplaceables[colname] = unreplaceables[colname] + 1
+	with metrics.stage("clean"):
+		for row in reader:
+			metrics.add("rows")
+			if row[flag_col] != None and row[flag_col] != '':
+				for colname in row[flag_col].split(separator):
+					if colname != None and colname != '' and colname != ' ':
+						if colname in reader.fieldnames:
+							row[colname] = None
+							if colname in replacements.keys():
+								replacements[colname] = replacements[colname] + 1
+							else:
+								replacements[colname] = 1
 						else:
-							unreplaceables[colname] = 1
-		writer.writerow(row)
+							print("Column mismatch: '"+colname+"'\tlisted in '"+flag_col+"' but not present in headers.")
+							if colname in unreplaceables.keys():
+								unreplaceables[colname] = unreplaceables[colname] + 1
+							else:
+								unreplaceables[colname] = 1
+			writer.writerow(row)
 	if len(replacements) > 0:
-		print "Here are the number of times each field was removed:"
+		print("Here are the number of times each field was removed:")
 		for key in replacements.keys():
-			print key+":\t", replacements[key]
+			print(key+":\t " + str(replacements[key]))
 	else:
-		print "No replacements were made."
+		print("No replacements were made.")
 	if len(unreplaceables) > 0:
-		print "And this is the number of unmatchable filed names found in '"+flag_col+"':"
+		print("And this is the number of unmatchable filed names found in '"+flag_col+"':")
 		for key in unreplaceables.keys():
-			print key, unreplaceables[key]
+			print(key + " " + str(unreplaceables[key]))
 
 
 
@@ -85,7 +99,7 @@ def clean_file(infile, outfile, flag_col, separator):
 
 
 def print_with_timestamp(msg):
-	print time.ctime() + ": " + msg
+	print(time.ctime() + ": " + msg)
 	sys.stdout.flush() # explicitly flushing stdout makes sure that a .out file stays up to date - otherwise it can be hard to keep track of whether a background job is hanging
 
 
@@ -98,13 +112,13 @@ def get_args():
 	parser.add_argument("output_file", help="required argument: the file we'll be saving cleaned data into. If this file already exists it will be overwritten.")
 	parser.add_argument("flag_col", help="required argument: the name of the column that flags out of range values.")
 
-# optional argument
+# optional arguments
 	parser.add_argument("-s", "--separator", help="the character that separates values within the out of range column. Default is ';'.", nargs='?', default=';')
+	instrumentation.add_arguments(parser)
 
 	return parser.parse_args()
 
 
 
 if __name__ == "__main__":
-	sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 	main()
@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+# Transparent reading and writing of compressed files, for the CSV tools in
+# this repository. Works in both Python 2 and Python 3.
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+# open_file() is a drop-in replacement for open():
+#	with compressed_io.open_file("readings.csv.gz", 'rU') as infile:
+#		reader = csv.reader(infile)
+# When reading, the codec comes from the file's first few bytes, so a file is
+# read correctly whatever it's called. When writing, it comes from the file
+# name's extension. Supported:
+#	.gz		gzip, including multi-member files as written by pigz or cat
+#	.bz2	bzip2
+#	.xz		xz / LZMA. In Python 2 this needs: pip install backports.lzma
+#	.zst	zstandard, if installed: pip install zstandard
+# Anything else is treated as an uncompressed file.
+#
+# Compressed input is decompressed in a background thread, in large blocks,
+# so that decompression overlaps with whatever the caller does with the data.
+# Compressed streams can be rewound to the start with seek(0), but can't seek
+# anywhere else.
+#
+# In Python 2, compressed files are always opened in binary mode, which is
+# what the csv and unicodecsv modules want there anyway; plain files are
+# opened exactly as open() would, so 'rU' still gets universal newlines.
+
+import bz2
+import gzip
+import io
+import sys
+import threading
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue # Python 2
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma # Python 2: pip install backports.lzma
+	except ImportError:
+		lzma = None
+
+try:
+	import zstandard # optional: pip install zstandard
+except ImportError:
+	zstandard = None
+
+
+# Bytes read or written at a time
+buffer_size = 1 << 20
+
+# Number of decompressed blocks the background thread can get ahead by
+read_ahead_blocks = 4
+
+extensions = {
+	'.gz': 'gzip',
+	'.bz2': 'bz2',
+	'.xz': 'xz',
+	'.zst': 'zstd',
+	'.zstd': 'zstd'
+}
+
+magic_numbers = [
+	(b"\x1f\x8b", 'gzip'),
+	(b"BZh", 'bz2'),
+	(b"\xfd7zXZ\x00", 'xz'),
+	(b"\x28\xb5\x2f\xfd", 'zstd')
+]
+
+python2 = sys.version_info[0] == 2
+
+
+
+
+# encoding and newline are as for Python 3's open(), and only apply in
+# Python 3 text mode
+def open_file(filename, mode='r', encoding=None, newline=None):
+	if 'r' in mode:
+		codec = sniff_codec(filename)
+	else:
+		codec = codec_from_extension(filename)
+	if codec is None:
+		if python2:
+			return open(filename, mode, buffer_size)
+		return open(filename, mode, buffer_size, encoding=encoding, newline=newline)
+
+	if 'r' in mode:
+		stream = io.BufferedReader(BackgroundReader(filename, codec), buffer_size)
+	else:
+		stream = open_compressed(filename, codec, 'wb')
+	if python2 or 'b' in mode:
+		return stream
+	return io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+
+
+
+def codec_from_extension(filename):
+	for extension in extensions:
+		if filename.lower().endswith(extension):
+			return extensions[extension]
+	return None
+
+
+
+def sniff_codec(filename):
+	with open(filename, 'rb') as f:
+		start = f.read(8)
+	for magic, codec in magic_numbers:
+		if start.startswith(magic):
+			return codec
+	return None
+
+
+
+# Returns a binary file object for filename that compresses or decompresses
+# with the given codec
+def open_compressed(filename, codec, mode):
+	if codec == 'gzip':
+		return gzip.GzipFile(filename, mode, compresslevel=6)
+	elif codec == 'bz2':
+		return bz2.BZ2File(filename, mode)
+	elif codec == 'xz':
+		if lzma is None:
+			raise IOError(filename + " is xz compressed, which needs the backports.lzma module in Python 2: pip install backports.lzma")
+		return lzma.LZMAFile(filename, mode)
+	elif codec == 'zstd':
+		if zstandard is None:
+			raise IOError(filename + " is zstandard compressed, which needs the zstandard module: pip install zstandard")
+		f = open(filename, mode)
+		if 'r' in mode:
+			try:
+				return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+			except TypeError: # older versions of zstandard
+				return zstandard.ZstdDecompressor().stream_reader(f)
+		return zstandard.ZstdCompressor().stream_writer(f)
+	raise ValueError("Unknown codec: " + str(codec))
+
+
+
+
+# A raw, read-only stream of the decompressed contents of a file, which a
+# background thread decompresses block by block into a bounded queue.
+# Meant to be wrapped in an io.BufferedReader, as open_file() does.
+class BackgroundReader(io.RawIOBase):
+	def __init__(self, filename, codec):
+		self.filename = filename
+		self.codec = codec
+		self.start()
+
+	def start(self):
+		self.blocks = queue.Queue(read_ahead_blocks)
+		self.block = b""
+		self.offset = 0
+		self.position = 0
+		self.finished = False
+		self.stopping = threading.Event()
+		self.thread = threading.Thread(target=self.decompress)
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Runs in the background thread. Ends with an empty block, or the exception
+	# that stopped it.
+	def decompress(self):
+		try:
+			source = open_compressed(self.filename, self.codec, 'rb')
+			try:
+				while not self.stopping.is_set():
+					block = source.read(buffer_size)
+					self.put(block)
+					if not block:
+						break
+			finally:
+				source.close()
+		except Exception as e:
+			self.put(e)
+
+	# Gives up if the reader is closed or rewound while the queue is full
+	def put(self, item):
+		while not self.stopping.is_set():
+			try:
+				self.blocks.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+	def stop(self):
+		self.stopping.set()
+		self.thread.join()
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.position
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			offset += self.position
+		elif whence != 0:
+			raise io.UnsupportedOperation("compressed files can only be rewound to the start")
+		if offset == 0:
+			self.stop()
+			self.start()
+		elif offset != self.position:
+			raise io.UnsupportedOperation("compressed files can only be rewound to the start")
+		return self.position
+
+	def readinto(self, buffer):
+		if self.offset >= len(self.block):
+			if self.finished:
+				return 0
+			block = self.blocks.get()
+			if isinstance(block, Exception):
+				raise block
+			if not block:
+				self.finished = True
+				return 0
+			self.block = block
+			self.offset = 0
+		n = min(len(buffer), len(self.block) - self.offset)
+		buffer[:n] = self.block[self.offset:self.offset + n]
+		self.offset += n
+		self.position += n
+		return n
+
+	def close(self):
+		if not self.closed:
+			self.stop()
+		io.RawIOBase.close(self)
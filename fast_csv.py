@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+
+# Fast CSV reading and writing for the scripts in this repository, on top of
+# the standard library's csv module, which does its parsing and formatting in
+# C. Works in both Python 2 and Python 3, and with compressed files (see
+# compressed_io.py).
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+#	with fast_csv.open_file("readings.csv.gz") as infile:
+#		reader = fast_csv.DictReader(infile)
+#		with fast_csv.open_file("cleaned.csv", 'w') as outfile:
+#			writer = fast_csv.DictWriter(outfile, reader.fieldnames)
+#			writer.writeheader()
+#			writer.writerows(clean(row) for row in reader)
+#
+# open_file() opens a file the way the csv module wants it, with a large
+# buffer. In Python 3 that's as text in the given encoding (UTF-8 unless
+# told otherwise) with newline="". In Python 2 it's as bytes, and values are
+# passed through as they are, without being decoded and encoded again on the
+# way: these scripts only ever copy values or read numbers out of them, so
+# any ASCII-compatible encoding (UTF-8, Latin-1...) comes through byte for
+# byte.
+#
+# reader() and writer() are the csv module's own. DictReader and DictWriter
+# work like the csv module's, only faster: DictReader's rows come from a
+# generator rather than a Python-level next(), and DictWriter doesn't check
+# each row for keys that aren't in its fieldnames, which it ignores as if
+# extrasaction="ignore". DictWriter.writerows() passes all its rows to the C
+# writer in one call, which is much quicker than calling writerow() for each.
+#
+# lazy_import() is for heavy modules like xlrd and openpyxl, so that they're
+# only loaded once they're actually used, and short runs (or --help) start
+# straight away.
+
+import csv
+import importlib
+import sys
+
+import compressed_io # shared with the other scripts here; reads and writes .gz, .bz2, .xz and .zst files transparently
+
+python2 = sys.version_info[0] == 2
+
+if python2:
+	from itertools import izip as zip
+
+reader = csv.reader
+writer = csv.writer
+
+
+
+
+def open_file(filename, mode='r', encoding="utf-8"):
+	mode = mode.replace('b', '').replace('U', '')
+	if python2:
+		if 'r' in mode:
+			return compressed_io.open_file(filename, 'rU') # universal newlines, as the scripts here have always used
+		return compressed_io.open_file(filename, mode + 'b')
+	return compressed_io.open_file(filename, mode, encoding=encoding, newline="")
+
+
+
+# Rows with more fields than fieldnames keep the rest as a list under restkey;
+# rows with fewer have restval for the missing ones. Blank lines are skipped.
+class DictReader(object):
+	def __init__(self, f, fieldnames=None, restkey=None, restval=None, **kwargs):
+		self.reader = csv.reader(f, **kwargs)
+		if fieldnames is None:
+			fieldnames = next(self.reader, None)
+		self.fieldnames = fieldnames
+		self.restkey = restkey
+		self.restval = restval
+
+	def __iter__(self):
+		return self.rows()
+
+	def rows(self):
+		fieldnames = self.fieldnames
+		width = len(fieldnames)
+		for row in self.reader:
+			if len(row) == width:
+				yield dict(zip(fieldnames, row))
+			elif len(row) > 0:
+				rowdict = dict(zip(fieldnames, row))
+				if len(row) > width:
+					rowdict[self.restkey] = row[width:]
+				else:
+					for key in fieldnames[len(row):]:
+						rowdict[key] = self.restval
+				yield rowdict
+
+
+
+class DictWriter(object):
+	def __init__(self, f, fieldnames, restval="", **kwargs):
+		self.writer = csv.writer(f, **kwargs)
+		self.fieldnames = list(fieldnames)
+		self.restval = restval
+
+	def writeheader(self):
+		return self.writer.writerow(self.fieldnames)
+
+	def writerow(self, rowdict):
+		return self.writer.writerow([rowdict.get(key, self.restval) for key in self.fieldnames])
+
+	def writerows(self, rowdicts):
+		fieldnames = self.fieldnames
+		restval = self.restval
+		return self.writer.writerows([rowdict.get(key, restval) for key in fieldnames] for rowdict in rowdicts)
+
+
+
+
+# Returns a stand-in for the named module, which imports it the first time
+# one of its attributes is used:
+#	xlrd = fast_csv.lazy_import("xlrd")
+def lazy_import(name):
+	return LazyModule(name)
+
+
+
+class LazyModule(object):
+	def __init__(self, name):
+		self.lazy_module_name = name
+
+	# Only called for attributes that aren't already here. Copying the module's
+	# namespace in means this only happens once for each of them.
+	def __getattr__(self, attr):
+		module = importlib.import_module(self.lazy_module_name)
+		self.__dict__.update(module.__dict__)
+		return getattr(module, attr)
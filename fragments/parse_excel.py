@@ -1,4 +1,4 @@
-#! /usr/bin/env python
+#! /usr/bin/env python3
 
 #  Script to parse Excel files from Peru's financial regulator
 # Written as an exercise for MIX
@@ -7,7 +7,7 @@ __author__ = "Eldan Goldenberg, March 2015"
 
 
 # TODO to make this more useful:
-# 1. break up that main function into a few parts
+# 1. break up what's left of that main function into a few parts
 # 2. comment, comment, comment
 # 3. add option to output .xlsx, which Tableau handles better
 # 4. make interim output optional
@@ -16,233 +16,548 @@ __author__ = "Eldan Goldenberg, March 2015"
 
 
 import argparse
-import copy
-import unicodecsv as csv # unicode-aware replacement for the standard Python csv module. pip install unicodecsv. https://github.com/jdunck/python-unicodecsv
+import hashlib
+import multiprocessing
+import operator
 import os
+import pickle
+import re
 import sys
+import tempfile
+import threading
 import time
-import xlrd  # Python Excel reader. pip install xlrd. Documentation at https://secure.simplistix.co.uk/svn/xlrd/trunk/xlrd/doc/xlrd.html?p=4966
+import zlib
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fast_csv # shared with the scripts in the parent directory; fast CSV reading and writing
+import instrumentation # also shared; --metrics and --profile
+
+# Python Excel reader. pip install xlrd. Documentation at https://secure.simplistix.co.uk/svn/xlrd/trunk/xlrd/doc/xlrd.html?p=4966
+# Only loaded once there's a workbook to parse, which there may not be if they're all cached
+xlrd = fast_csv.lazy_import("xlrd")
 
 
 
 def main():
   args = get_args()
   print_with_timestamp("Starting run.")
+  with instrumentation.run("parse_excel", args) as metrics:
+    globalheaders = ['dir', 'fname', 'sheet', 'year', 'month', 'day', 'title', 'date']
+
+    output_fields = [
+      'NAME_0',
+      'NAME_1',
+      'NAME_2',
+      'NAME_3',
+      'Type of Institution',
+      'Type of Access Point',
+      'Name of Company',
+      'Name of Branch',
+      'Metric Type',
+      'FSP Metrics',
+      'FSP Metrics Description',
+      'Date',
+      'Year',
+      'Month',
+      'Day'
+    ]
+
+# Each row goes to both outputs as soon as its workbook comes back from the pool, so only the workbooks in flight (see throttled()) are ever held in memory.
+# output.csv can be written straight away, but interim.csv's header row has every column from every workbook, which isn't known until the end.
+# So the interim rows are spooled to a temporary file in the meantime: globalheaders only ever grows at the end, so each spooled row is laid out by the headers seen so far and just needs empty cells adding on the end to fit the final header.
+    spool = tempfile.TemporaryFile(mode='w+', dir='.', encoding='utf-8', newline='')
+    interim_writer = fast_csv.writer(spool)
+    csvfile = fast_csv.open_file('output.csv', 'w')
+    writer = fast_csv.DictWriter(csvfile, fieldnames=output_fields)
+    writer.writeheader()
+
+# The workbooks are parsed in a pool of worker processes, one per core unless --processes says otherwise.
+# imap() hands each workbook to a worker as soon as find_workbooks() comes across it, and returns the results in the order the workbooks were found, so the output doesn't depend on which worker finishes first.
+    if args.cache_dir is not None and not os.path.isdir(args.cache_dir):
+      os.makedirs(args.cache_dir)
+    jobs = ((dirName, fname, args.cache_dir) for dirName, fname in find_workbooks(args.root_dir))
+    cachecount = 0
+    processes = args.processes or multiprocessing.cpu_count()
+    slots = threading.Semaphore(2 * processes)
+    stopping = threading.Event()
+    pool = multiprocessing.Pool(processes)
+    try:
+      for workbook in pool.imap(load_workbook, throttled(jobs, slots, stopping)):
+        slots.release()
+        for line in workbook['log']:
+          print(line)
+        sys.stdout.flush()
+        if workbook['failed']:
+          exit(1) # actually exit the script here, because we won't reach this condition unless something unforeseen has gone wrong
+        if workbook['cached']:
+          cachecount += 1
+# Workbooks are parsed (or loaded from the cache) in the worker processes, so their stage times are added up from what the workers report, and can come to more than the elapsed time
+        metrics.add_stage_time('read_cache' if workbook['cached'] else 'parse', workbook['seconds'])
+        metrics.add('workbooks')
+        metrics.add('input_bytes', workbook['bytes'])
+        for h in workbook['headers']:
+          if h not in globalheaders:
+            globalheaders.append(h)
+        with metrics.stage('write'):
+          for row in workbook['rows']:
+            interim_writer.writerow([row.get(h, '') for h in globalheaders])
+          writer.writerows(cleaned_rows(workbook['rows']))
+        metrics.add('rows', len(workbook['rows']))
+    except:
+      stopping.set()
+      slots.release() # in case the pool is waiting on throttled() for a slot, which would stop it shutting down
+      pool.terminate()
+      csvfile.close()
+      os.remove('output.csv') # don't leave half an output behind
+      raise
+    else:
+      pool.close()
+    finally:
+      pool.join()
+    csvfile.close()
+    if args.cache_dir is not None:
+      print_with_timestamp(str(cachecount) + " workbook[s] were unchanged since they were cached, so didn't need parsing again.")
+    print_with_timestamp("Loading complete and cleaned output file written, now writing raw file.")
+    spool.seek(0)
+    with metrics.stage('write_interim'), fast_csv.open_file('interim.csv', 'w') as csvfile:
+      writer = fast_csv.writer(csvfile)
+      writer.writerow(globalheaders)
+      padding = len(globalheaders)
+      writer.writerows(row + [''] * (padding - len(row)) for row in fast_csv.reader(spool))
+    spool.close()
+  print_with_timestamp("Run complete.")
+
+
+
+
+# imap() would otherwise take every job from find_workbooks() at once, and the workers would run as far ahead of the writing as they could, with all their results waiting in memory in this process.
+# So each job has to take one of the slots before it goes to the pool, and main() gives the slot back once that workbook has been written: no more than 2 workbooks per process are ever being parsed or waiting to be written.
+# pool.imap() reads this in a thread of its own, so waiting for a slot doesn't hold up main().
+def throttled(jobs, slots, stopping):
+  for job in jobs:
+    slots.acquire()
+    if stopping.is_set():
+      return
+    yield job
+
+
 
-  globalheaders = ['dir', 'fname', 'sheet', 'year', 'month', 'day', 'title', 'date']
 
-  data_frame = []
+# How output.csv is made from the source rows. Each sheet's headers are looked up in this just once, by compile_output_mapping(), rather than for every row.
+# Columns copied straight across, as (output field, source header)
+copied_columns = [
+  ('Name of Company', 'Empresa'),
+  ('NAME_1', 'Ubicación: Departamento'),
+  ('NAME_2', 'Ubicación: Provincia'),
+  ('NAME_3', 'Ubicación: Distrito')
+]
 
+# ASSUMPTION: that my inferences about these Spanish labels are correct (eek)!
+# Each source row gets an output row for each type of access point it counts any of, in this order.
+# Where a sheet has more than one of the headers for a type, the last one with a number in it wins.
+access_point_columns = [
+  ('ATM', ['Número de Cajeros Automáticos']),
+  ('Agent', ['Número de Cajeros Corresponsales 1/', 'Número de Cajeros Corresponsales 2/']),
+  ('Branch', ['Número de establecimientos con Cajeros Corresponsales 1/'])
+]
+
+# A row that counts none of them is a single branch, named after the company and the first of these that the sheet has
+branch_code_columns = ['Codigo Oficina', 'Código de oficina']
+
+# ASSUMPTION: rows for companies matching this were total or subtotal rows in the source data, so we should skip them
+skipped_companies = re.compile(r'(?:Total general|Total CM)\Z|1/ |2/ |Nota: ')
+
+
+
+
+# Yields the cleaned output.csv row[s] for each row of source data: one per type of access point it counts
+def cleaned_rows(rows):
+  sheet_defaults = None
+  for row in rows:
+# Every row in a sheet has the same headers and the same sheet_defaults object, so the mapping and the sheet's own fields only change with the sheet
+    if row.sheet_defaults is not sheet_defaults:
+      sheet_defaults = row.sheet_defaults
+      mapping = compile_output_mapping(frozenset(row.cells))
+      sheet_row = sheet_fields(sheet_defaults)
+    values = mapping['getter'](row.cells)
+    if skipped_companies.match(values[0]):
+      continue
+    cleaned_row = dict(sheet_row)
+    for field, position in mapping['copied']:
+      cleaned_row[field] = values[position]
+    counts = []
+    for access_point, positions in mapping['access_points']:
+      count = 0
+      for position in positions:
+        if values[position] != '-' and values[position] != '':
+          count = float(values[position])
+      counts.append((access_point, count))
+    if sum(count for access_point, count in counts) == 0 and mapping['branch_code'] is not None:
+      cleaned_row['Name of Branch'] = values[0] + "-" + values[mapping['branch_code']]
+      counts = [(access_point, 1 if access_point == 'Branch' else count) for access_point, count in counts]
+    for access_point, count in counts:
+      if count > 0:
+        output_row = dict(cleaned_row)
+        output_row['Type of Access Point'] = access_point
+        output_row['FSP Metrics'] = count
+        yield output_row
+
+
+
+# Compiled mappings, keyed by the set of headers they were compiled for
+compiled_mappings = {}
+
+# Returns a dict of:
+# 'getter': fetches all the values the mapping uses from a row's cells in one call, as a tuple, with the company name ('Empresa') first
+# 'copied': (output field, position in that tuple) for each of copied_columns
+# 'access_points': (type, positions) for each of access_point_columns, with just the positions of the headers this sheet has
+# 'branch_code': the position of the sheet's branch code, or None if it hasn't got one
+def compile_output_mapping(headers):
+  if headers not in compiled_mappings:
+    keys = []
+    def position(key):
+      keys.append(key)
+      return len(keys) - 1
+    position('Empresa')
+    mapping = {
+      'copied': [(field, position(key)) for field, key in copied_columns],
+      'access_points': [
+        (access_point, [position(key) for key in keys_for_type if key in headers])
+        for access_point, keys_for_type in access_point_columns
+      ],
+      'branch_code': None
+    }
+    for key in branch_code_columns:
+      if key in headers:
+        mapping['branch_code'] = position(key)
+        break
+    mapping['getter'] = operator.itemgetter(*keys)
+    compiled_mappings[headers] = mapping
+  return compiled_mappings[headers]
+
+
+
+# The output fields that are the same for every row in a sheet
+def sheet_fields(sheet_defaults):
+  return {
+    'NAME_0': "Peru",
+    'Type of Institution': institution_type(sheet_defaults['dir']),
+    'FSP Metrics Description': "# Locations",
+    'Date': sheet_defaults['date'],
+    'Year': sheet_defaults['year'],
+    'Month': sheet_defaults['month'],
+    'Day': sheet_defaults['day']
+  }
+
+
+
+# ASSUMPTION: the type of institution is the third directory in the path, e.g. Rural Credit and Savings in Peru Data/Branch Data/Rural Credit and Savings
+def institution_type(dirName):
+  i = dirName.find('/') + 1
+  i+= dirName[i:].find('/') + 1
+  j = dirName[i:].find('/')
+  if j > -1:
+    return dirName[i:i+j]
+  return dirName[i:]
+
+
+
+
+# One row of source data: a dict of its own cells, plus the dict of values it shares with every other row in its sheet.
+# That dict is the same object for the whole sheet, so it's never copied and mustn't be changed.
+class SheetRow(object):
+  def __init__(self, sheet_defaults, cells):
+    self.sheet_defaults = sheet_defaults
+    self.cells = cells
+
+  def __getitem__(self, key):
+    if key in self.cells:
+      return self.cells[key]
+    return self.sheet_defaults[key]
+
+  def __contains__(self, key):
+    return key in self.cells or key in self.sheet_defaults
+
+  def get(self, key, default=None):
+    if key in self.cells:
+      return self.cells[key]
+    return self.sheet_defaults.get(key, default)
+
+  def __repr__(self):
+    merged = dict(self.sheet_defaults)
+    merged.update(self.cells)
+    return repr(merged)
+
+
+
+
+# Finds every .xls file within root_dir and its subdirectories, in os.walk() order, as (directory, file name) pairs
+def find_workbooks(root_dir):
 # ASSUMPTION: we want to parse every single .xls file found within args.root_dir and its subdirectories, but ignore anything else
-  for dirName, subdirList, fileList in os.walk(args.root_dir):
+  for dirName, subdirList, fileList in os.walk(root_dir):
     for fname in fileList:
       if fname[-4:].lower() != '.xls':
         print_with_timestamp("Skipping " + dirName +'/'+ fname + " because it's not a .xls file.")
       elif fname[0] == '~':
         pass # just skip these - they're temp files from having the Excel sheet open
       else:
-        book = xlrd.open_workbook(os.path.abspath(dirName + '/' + fname))
-
-        for sheet in book.sheets():
+        yield dirName, fname
+
+
+
+
+# Bump this whenever parse_workbook() changes what it extracts, so that older cached results aren't used
+cache_version = 2
+
+# Runs in a worker process. If there's a cache_dir, a workbook whose cached results were made from a file of the same size and modification time, found under the same directory name, is loaded from there instead of being parsed again.
+# Each workbook is cached in its own file, named after the SHA-1 of its path, as a zlib-compressed pickle.
+# The result also says how long that took, in 'seconds', and how big the workbook is, in 'bytes'.
+def load_workbook(job):
+  dirName, fname, cache_dir = job
+  starttime = time.time()
+  path = os.path.abspath(dirName + '/' + fname)
+  stat = os.stat(path)
+  if cache_dir is None:
+    workbook = parse_workbook((dirName, fname))
+  else:
+    key = (cache_version, dirName, fname, stat.st_size, stat.st_mtime)
+    cachefile = os.path.join(cache_dir, hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest() + '.cache')
+    workbook = read_cached_workbook(cachefile, key)
+    if workbook is None:
+      workbook = parse_workbook((dirName, fname))
+      if not workbook['failed']:
+        write_cached_workbook(cachefile, key, workbook)
+  workbook['seconds'] = time.time() - starttime
+  workbook['bytes'] = stat.st_size
+  return workbook
+
+
+
+# Returns None if there's no usable cached copy, for whatever reason
+def read_cached_workbook(cachefile, key):
+  try:
+    with open(cachefile, 'rb') as f:
+      entry = pickle.loads(zlib.decompress(f.read()))
+  except Exception:
+    return None
+  if entry['key'] != key:
+    return None
+  workbook = entry['workbook']
+  workbook['rows'] = [SheetRow(sheet_defaults, cells) for sheet_defaults, cells in workbook['rows']]
+  workbook['cached'] = True
+  return workbook
+
+
+
+# Rows are stored as (sheet_defaults, cells) pairs; pickle stores each sheet's shared sheet_defaults just once
+# If the cache can't be written (a full disk, say), that's logged as a warning and the run carries on without it
+def write_cached_workbook(cachefile, key, workbook):
+  entry = {
+    'key': key,
+    'workbook': {
+      'headers': workbook['headers'],
+      'rows': [(row.sheet_defaults, row.cells) for row in workbook['rows']],
+      'log': workbook['log'],
+      'failed': workbook['failed']
+    }
+  }
+  tmpfile = cachefile + '.' + str(os.getpid())
+  try:
+    with open(tmpfile, 'wb') as f:
+      f.write(zlib.compress(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmpfile, cachefile)
+  except OSError as e:
+    workbook['log'].append(timestamped("Warning: couldn't write the cache file " + cachefile + ": " + str(e)))
+    try:
+      os.remove(tmpfile)
+    except OSError:
+      pass
+
+
+
+
+# Parses one workbook. Returns a dict of:
+# 'headers': its column headers, in the order they first appear
+# 'rows': its data rows, as SheetRows
+# 'log': timestamped messages for main() to print, so they come out in order
+# 'failed': True if a sheet had no data table, which should stop the run
+# 'cached': True if this came from the cache rather than from parsing the workbook
+def parse_workbook(path):
+  dirName, fname = path
+  bookheaders = []
+  rows = []
+  log = []
+  failed = False
+  book = xlrd.open_workbook(os.path.abspath(dirName + '/' + fname))
+
+  for sheet in book.sheets():
 # ASSUMPTION: some workbooks contain empty sheets; just skip those
-          if sheet.nrows is 0 or sheet.ncols is 0:
-            pass
-          else:
-#            print_with_timestamp("Parsing sheet named " + sheet.name.encode('utf-8', 'ignore') + ".")
+    if sheet.nrows == 0 or sheet.ncols == 0:
+      pass
+    else:
+#            print_with_timestamp("Parsing sheet named " + sheet.name + ".")
 # ASSUMPTION: all worksheets we care about have a human-readable title in either A1, A2 or B1, and if it's A2 or B1 then the entire column A is empty
 # (i.e. I know there's at least one worksheet that doesn't fit this pattern, in Peru Data/Branch Data/Financial Institution/B-3241-jl2009.XLS, because it's just a summary of data that's in the form I can work with in another worksheet in the same file)
 # I did find one other exception to this pattern, in Peru Data/Branch Data/Rural Credit and Savings//C-2234-fe2009.XLS. Because it's exactly one file, I manually edited that one to make it comply.
-            if sheet.cell_value(0,0) != "":
-              title = sheet.cell_value(0,0).encode('utf-8', 'ignore')
-              firstrow = firstcol = 0
-            elif sheet.cell_value(0,1) != "":
-              title = sheet.cell_value(0,1).encode('utf-8', 'ignore')
-              firstrow = 0
-              firstcol = 1
-            elif sheet.cell_value(1,0) != "":
-              title = sheet.cell_value(1,0).encode('utf-8', 'ignore')
-              firstrow = 1
-              firstcol = 0
-            else:
-              print_with_timestamp("Can't find title cell in sheet " + sheet.name.encode('utf-8', 'ignore') + " in file " + os.path.abspath(dirName + '/' + fname))
-              break # just skip these sheets
+      if sheet.cell_value(0,0) != "":
+        title = sheet.cell_value(0,0)
+        firstrow = firstcol = 0
+      elif sheet.cell_value(0,1) != "":
+        title = sheet.cell_value(0,1)
+        firstrow = 0
+        firstcol = 1
+      elif sheet.cell_value(1,0) != "":
+        title = sheet.cell_value(1,0)
+        firstrow = 1
+        firstcol = 0
+      else:
+        log.append(timestamped("Can't find title cell in sheet " + sheet.name + " in file " + os.path.abspath(dirName + '/' + fname)))
+        break # just skip these sheets
 # ASSUMPTION: every sheet has a date line immediately below the title.  This can be either an Excel date type (shows up as a float in Python) or a text string
-            dateline = sheet.cell_value(firstrow+1,firstcol)
-            if type(dateline) is float:
-              dateline = xlrd.xldate_as_tuple(dateline, book.datemode)
-              dateyear = dateline[0]
-              datemonth = dateline[1]
-              dateday = dateline[2]
-            else:
-# ASSUMPTION: every text date line is in the form "Al DD de MES [de] YYYY", possibly with spaces and/or parentheses before and/or after
-              i = dateline.find('Al ')+3
-              dateday = int(dateline[i:i+3])
-              i = dateline.find('de ',i)+3
-              i_end = dateline.find(' ',i)
-              datemonth = month_int_from_spanish(dateline[i:i_end])
-              i = dateline.find('2',i)
-              dateyear = int(dateline[i:i+4])
-            datestring = make_date_string(dateyear, datemonth, dateday)
-# ASSUMPTION: every sheet's actual data table starts with a cell labeled "Empresa", which is the beginning of a double header row
-            headers = []
-            for row in range (firstrow+2, sheet.nrows):
-              if sheet.cell_value(row,firstcol) == u'Empresa':
-                for col in range (firstcol, sheet.ncols):
-                  item = sheet.cell_value(row, col)
-                  if item != '':
-                    headers.append(str(item.encode('utf-8', 'ignore')))
-                  else:
-                    headers.append(headers[col-1-firstcol])
-                row += 1
-                for col in range (firstcol, sheet.ncols):
-                  item = sheet.cell_value(row, col)
-                  if item != '':
-                    headers[col-firstcol] += ": " + str(item.encode('utf-8', 'ignore'))
-                firstdatarow = row + 1
-                break
-            else:
-              print_with_timestamp("Can't find start of data table in " + sheet.name.encode('utf-8', 'ignore') + " in file " + os.path.abspath(dirName + '/' + fname))
-              exit(1) # actually exit the script here, because we won't reach this condition unless something unforeseen has gone wrong
-            for h in headers:
-              if h not in globalheaders:
-                globalheaders.append(h)
+      dateline = sheet.cell_value(firstrow+1,firstcol)
+      if type(dateline) is float:
+        dateline = xlrd.xldate_as_tuple(dateline, book.datemode)
+        dateyear = dateline[0]
+        datemonth = dateline[1]
+        dateday = dateline[2]
+      else:
+        dateday, datemonth, dateyear = parse_text_dateline(dateline)
+      datestring = make_date_string(dateyear, datemonth, dateday)
+      layout = scan_header_layout(sheet, firstrow, firstcol)
+      if layout is not None:
+        headers = layout['headers']
+        firstdatarow = layout['headerrow'] + 2
+      else:
+        log.append(timestamped("Can't find start of data table in " + sheet.name + " in file " + os.path.abspath(dirName + '/' + fname)))
+        failed = True # main() stops the run when it gets to this workbook
+        break
+      for h in headers:
+        if h not in bookheaders:
+          bookheaders.append(h)
 # ASSUMPTION: there can be blank row[s] after the headers, and if the first cell is blank then the entire row will be.
-            while sheet.cell_value(firstdatarow,firstcol) == '':
-              firstdatarow += 1
-            sheet_defaults = {
-              'dir': dirName,
-              'fname': fname,
-              'sheet': sheet.name.encode('utf-8', 'ignore'),
-              'year': dateyear,
-              'month': datemonth,
-              'day': dateday,
-              'title': title,
-              'date': datestring
-            }
-            prev_row = {}
+      while sheet.cell_value(firstdatarow,firstcol) == '':
+        firstdatarow += 1
+      sheet_defaults = {
+        'dir': dirName,
+        'fname': fname,
+        'sheet': sheet.name,
+        'year': dateyear,
+        'month': datemonth,
+        'day': dateday,
+        'title': title,
+        'date': datestring
+      }
+      prev_row = {}
 # ASSUMPTION: every blank cell represents the same value as the cell above it (as though the cells were merged)
-            for row in range (firstdatarow, sheet.nrows):
-              i = 0
-              row_data = {}
+      for row in range (firstdatarow, sheet.nrows):
+        i = 0
+        row_data = {}
 #              print row_data
-              row_data = copy.deepcopy(sheet_defaults)
-              for col in range (firstcol,sheet.ncols):
-                item = sheet.cell_value(row, col)
-                if (item is None or item == '') and (len(prev_row) > 0):
-                  row_data[headers[i]] = prev_row[headers[i]]
-                else:
-                  row_data[headers[i]] = str(unicode(sheet.cell_value(row, col)).encode('utf-8', 'ignore'))
-                i+=1
-                if item == "5433" or item == 5433: print row_data
-              prev_row = row_data
+        for col in range (firstcol,sheet.ncols):
+          item = sheet.cell_value(row, col)
+          if (item is None or item == '') and (len(prev_row) > 0):
+            row_data[headers[i]] = prev_row[headers[i]]
+          else:
+            row_data[headers[i]] = cell_text(item)
+          i+=1
+        prev_row = row_data
 #              print sheet_defaults
 #              print row_data
-              data_frame.append(row_data)
-#              print len(data_frame)
-  print_with_timestamp("Loading complete, now writing raw file.")
-  with open('interim.csv', 'w') as csvfile:
-    writer = csv.DictWriter(csvfile, fieldnames=globalheaders)
-    writer.writeheader()
-    for row in data_frame:
-      writer.writerow(row)
-  print_with_timestamp("Raw file written, now writing cleaned output file.")
-  with open('output.csv', 'w') as csvfile:
-    fields = [
-      'NAME_0',
-      'NAME_1',
-      'NAME_2',
-      'NAME_3',
-      'Type of Institution',
-      'Type of Access Point',
-      'Name of Company',
-      'Name of Branch',
-      'Metric Type',
-      'FSP Metrics',
-      'FSP Metrics Description',
-      'Date',
-      'Year',
-      'Month',
-      'Day'
-    ]
-    writer = csv.DictWriter(csvfile, fieldnames=fields)
-    writer.writeheader()
-    for row in data_frame:
-# ASSUMPTION: the following few rows are special cases which were total or subtotal rows in the source data, so we should skip them
-      if row['Empresa'] == "Total general": pass
-      elif row['Empresa'] == "Total CM": pass
-      elif row['Empresa'][0:3] == "1/ ": pass
-      elif row['Empresa'][0:3] == "2/ ": pass
-      elif row['Empresa'][0:6] == "Nota: ": pass
-      else:
-        cleaned_row = {}
-        atms = 0
-        branches = 0
-        agents = 0
-        cleaned_row['NAME_0'] = "Peru"
-        cleaned_row['NAME_1'] = row['Ubicaci\xc3\xb3n: Departamento']
-        cleaned_row['NAME_2'] = row['Ubicaci\xc3\xb3n: Provincia']
-        cleaned_row['NAME_3'] = row['Ubicaci\xc3\xb3n: Distrito']
-        i = row['dir'].find('/') + 1
-        i+= row['dir'][i:].find('/') + 1
-        j = row['dir'][i:].find('/')
-        if j > -1:
-          cleaned_row['Type of Institution'] = row['dir'][i:i+j]
+        rows.append(SheetRow(sheet_defaults, row_data))
+#              print len(rows)
+  return {'headers': bookheaders, 'rows': rows, 'log': log, 'failed': failed, 'cached': False}
+
+
+
+
+# Numbers are written to 12 significant figures, as Python 2's str() did, so the outputs are the same as they've always been.
+# Like str(), whole numbers of up to 11 digits get a '.0', and bigger ones are written as e.g. 1.23456789012e+11.
+# str() left the trailing zeros on when a whole number below 1e15 was exactly halfway and rounded down, e.g. 1.23456789010e+12 for 1234567890105.0
+def cell_text(value):
+  if isinstance(value, float):
+    text = '%.12g' % value
+    whole = text.lstrip('-').isdigit()
+    if whole and len(text.lstrip('-')) <= 11:
+      return text + '.0'
+    if whole or 'e' in text:
+      mantissa, exponent = ('%.11e' % value).split('e')
+      digits = '%d' % abs(value)
+      rest = digits[12:]
+      if not (value.is_integer() and abs(value) < 1e15 and rest == '5' + '0' * (len(rest) - 1) and digits[11] in '02468'):
+        mantissa = mantissa.rstrip('0').rstrip('.')
+      return mantissa + 'e' + exponent
+    return text
+  return str(value)
+
+
+
+
+# ASSUMPTION: every sheet's actual data table starts with a cell labeled "Empresa", which is the beginning of a double header row
+# Returns the layout as a dict of:
+# 'headerrow': the row containing "Empresa"; the data starts 2 rows below it, after any blank rows
+# 'headers': the merged column headers, with headers[i] for column firstcol + i
+# or None if there isn't an "Empresa" cell in column firstcol
+def scan_header_layout(sheet, firstrow, firstcol):
+  headers = []
+  for row in range (firstrow+2, sheet.nrows):
+    if sheet.cell_value(row,firstcol) == u'Empresa':
+      for col in range (firstcol, sheet.ncols):
+        item = sheet.cell_value(row, col)
+        if item != '':
+          headers.append(item)
         else:
-          cleaned_row['Type of Institution'] = row['dir'][i:]
-        cleaned_row['Date'] = row['date']
-        cleaned_row['Year'] = row['year']
-        cleaned_row['Month'] = row['month']
-        cleaned_row['Day'] = row['day']
-        cleaned_row['Name of Company'] = row['Empresa']
-# ASSUMPTION: that my inferences about these Spanish labels are correct (eek)!
-        if 'N\xc3\xbamero de Cajeros Autom\xc3\xa1ticos' in row and row['N\xc3\xbamero de Cajeros Autom\xc3\xa1ticos'] != '-' and row['N\xc3\xbamero de Cajeros Autom\xc3\xa1ticos'] != '':
-          atms = float(row['N\xc3\xbamero de Cajeros Autom\xc3\xa1ticos'])
-        if 'N\xc3\xbamero de Cajeros Corresponsales 1/' in row and row['N\xc3\xbamero de Cajeros Corresponsales 1/'] != '-' and row['N\xc3\xbamero de Cajeros Corresponsales 1/'] != '' and row['N\xc3\xbamero de Cajeros Corresponsales 1/'] > 0:
-          agents = float(row['N\xc3\xbamero de Cajeros Corresponsales 1/'])
-        if 'N\xc3\xbamero de establecimientos con Cajeros Corresponsales 1/' in row and row['N\xc3\xbamero de establecimientos con Cajeros Corresponsales 1/'] != '-' and row['N\xc3\xbamero de establecimientos con Cajeros Corresponsales 1/'] != '':
-          branches = float(row['N\xc3\xbamero de establecimientos con Cajeros Corresponsales 1/'])
-        if 'N\xc3\xbamero de Cajeros Corresponsales 2/' in row and row['N\xc3\xbamero de Cajeros Corresponsales 2/'] != '-' and row['N\xc3\xbamero de Cajeros Corresponsales 2/'] != '':
-          agents = float(row['N\xc3\xbamero de Cajeros Corresponsales 2/'])
-        if agents + branches + atms == 0:
-          if 'Codigo Oficina' in row:
-            branches = 1
-            cleaned_row['Name of Branch'] = row['Empresa'] + "-" + row['Codigo Oficina']
-          elif 'C\xc3\xb3digo de oficina' in row:
-            branches = 1
-            cleaned_row['Name of Branch'] = row['Empresa'] + "-" + row['C\xc3\xb3digo de oficina']
-        cleaned_row['FSP Metrics Description'] = "# Locations"
-        if atms > 0:
-          cleaned_row['Type of Access Point'] = "ATM"
-          cleaned_row['FSP Metrics'] = atms
-          writer.writerow(cleaned_row)
-        if agents > 0:
-          cleaned_row['Type of Access Point'] = "Agent"
-          cleaned_row['FSP Metrics'] = agents
-          writer.writerow(cleaned_row)
-        if branches > 0:
-          cleaned_row['Type of Access Point'] = "Branch"
-          cleaned_row['FSP Metrics'] = branches
-          writer.writerow(cleaned_row)
-  print_with_timestamp("Run complete.")
+          headers.append(headers[col-1-firstcol])
+      for col in range (firstcol, sheet.ncols):
+        item = sheet.cell_value(row+1, col)
+        if item != '':
+          headers[col-firstcol] += ": " + item
+      return {
+        'headerrow': row,
+        'headers': headers
+      }
+  return None
+
 
 
 
+# The same few date lines turn up over and over, so each distinct one is only parsed once per process
+parsed_datelines = {}
+
+# ASSUMPTION: every text date line is in the form "Al DD de MES [de] YYYY", possibly with spaces and/or parentheses before and/or after
+# Returns (day, month, year)
+def parse_text_dateline(dateline):
+  if dateline not in parsed_datelines:
+    i = dateline.find('Al ')+3
+    dateday = int(dateline[i:i+3])
+    i = dateline.find('de ',i)+3
+    i_end = dateline.find(' ',i)
+    datemonth = month_int_from_spanish(dateline[i:i_end])
+    i = dateline.find('2',i)
+    dateyear = int(dateline[i:i+4])
+    parsed_datelines[dateline] = (dateday, datemonth, dateyear)
+  return parsed_datelines[dateline]
+
+
+
+
+spanish_months = {
+  'enero': 1,
+  'febrero': 2,
+  'marzo': 3,
+  'abril': 4,
+  'mayo': 5,
+  'junio': 6,
+  'julio': 7,
+  'agosto': 8,
+  'septiembre': 9,
+  'setiembre': 9, # "setiembre" seems to be a common typo....
+  'octubre': 10,
+  'noviembre': 11,
+  'diciembre': 12
+}
 
 def month_int_from_spanish(mes):
-  mes = mes.lower() # just to make it case-insenstive
-  if mes == 'enero': return 1
-  elif mes == 'febrero': return 2
-  elif mes == 'marzo': return 3
-  elif mes == 'abril': return 4
-  elif mes == 'mayo': return 5
-  elif mes == 'junio': return 6
-  elif mes == 'julio': return 7
-  elif mes == 'agosto': return 8
-  elif mes == 'septiembre' or mes == "setiembre": return 9 # "setiembre" seems to be a common typo....
-  elif mes == 'octubre': return 10
-  elif mes == 'noviembre': return 11
-  elif mes == 'diciembre': return 12
-  else: return None
+  return spanish_months.get(mes.lower()) # lower() just to make it case-insenstive
 
 
 
@@ -254,22 +569,31 @@ def make_date_string(y,m,d, sep="-"):
 
 
 def print_with_timestamp(msg):
-  print time.ctime() + ": " + msg
+  print(timestamped(msg))
   sys.stdout.flush() # explicitly flushing stdout makes sure that a .out file stays up to date - otherwise it can be hard to keep track of whether a background job is hanging
 
 
 
+def timestamped(msg):
+  return time.ctime() + ": " + msg
+
+
+
 def get_args():
   parser = argparse.ArgumentParser(description="Import and/or update OSM data.")
 
 # positional argument
   parser.add_argument("root_dir", help="required argument: the root directory within which we should find files to parse")
 
+# optional arguments
+  parser.add_argument("--cache-dir", help="directory in which to keep the results of parsing each workbook. On later runs, workbooks that haven't changed are loaded from there rather than parsed again, which is much faster.")
+  parser.add_argument("--processes", help="number of workbooks to parse at once, each in its own process. Default is one per CPU core.", type=int, metavar="N")
+  instrumentation.add_arguments(parser)
+
   args = parser.parse_args()
   return args
 
 
 
 if __name__ == "__main__":
-  sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
   main()
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+
+# Progress metrics and profiling for the scripts in this repository, so that
+# long runs can be watched and their time accounted for. Works in both
+# Python 2 and Python 3.
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+# A script adds the command line options with add_arguments(parser), and
+# wraps its work in run():
+#	with instrumentation.run("aggregate_csv", args) as metrics:
+#		with metrics.stage("parse"):
+#			for row in reader:
+#				metrics.add("rows")
+#				...
+# which gives it:
+#	--metrics FILE: JSON lines written to FILE ("-" for stderr): a "progress"
+#		line every --metrics-interval seconds while the script runs, and a
+#		"summary" line at the end, even if it fails. Each line has the time
+#		spent so far in each stage, the counters (rows, bytes...) with their
+#		rates per second over the whole run, the stage in progress, and the
+#		peak memory (RSS) of the script and of any worker processes it has
+#		finished with.
+#	--profile FILE: the whole run profiled with cProfile, and the stats saved
+#		to FILE, to read with: python -m pstats FILE
+#		Only the main process is profiled, not any worker processes.
+# Without either, all this costs is the stage timings and the counter
+# updates, which are a dictionary update each: a script counting rows one at
+# a time pays that for every row.
+#
+# Stages can be timed in the script itself with metrics.stage(), or by
+# worker processes and added in with metrics.add_stage_time(). Time the
+# script spends outside any stage is left out of the stage totals, but is in
+# the total elapsed time. Counters should only count work that's been done
+# (so add a file's size once it's been read, not before), to keep their
+# rates honest.
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None # not on Windows, so no peak memory there
+
+
+default_interval = 10.0
+
+
+
+
+def add_arguments(parser):
+	parser.add_argument("--metrics", help="write progress metrics and a final summary to this file as JSON lines, or to stderr if it's -.", metavar="FILE")
+	parser.add_argument("--metrics-interval", help="seconds between --metrics progress lines. Default is " + str(int(default_interval)) + ".", type=float, default=default_interval, metavar="SECONDS")
+	parser.add_argument("--profile", help="profile the run with cProfile and save the stats to this file.", metavar="FILE")
+
+
+
+# Times the with block as one run of the script, with the metrics and
+# profiling asked for in args (any of which may be missing)
+@contextlib.contextmanager
+def run(script, args=None):
+	metrics = Metrics(
+			script,
+			getattr(args, 'metrics', None),
+			getattr(args, 'metrics_interval', default_interval),
+			getattr(args, 'profile', None)
+	)
+	metrics.start()
+	status = "failed"
+	try:
+		yield metrics
+		status = "ok"
+	except SystemExit as e:
+		if e.code is None or e.code == 0:
+			status = "ok"
+		raise
+	finally:
+		metrics.finish(status)
+
+
+
+# Peak resident set size in MB of this process, and of the largest of its
+# finished child processes, or None where that can't be measured
+def peak_rss_mb():
+	if resource is None:
+		return None, None
+	scale = 1e6 if sys.platform == "darwin" else 1e3 # macOS reports ru_maxrss in bytes, Linux in KB
+	return (
+		round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+		round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+	)
+
+
+
+
+class Metrics(object):
+	def __init__(self, script, metrics_file=None, interval=default_interval, profile_file=None):
+		self.script = script
+		self.metrics_file = metrics_file
+		self.interval = interval
+		self.profile_file = profile_file
+		self.stages = {}
+		self.counters = {}
+		self.current_stage = None
+		self.starttime = time.time()
+		self.output = None
+		self.lock = threading.Lock()
+		self.stopping = threading.Event()
+		self.reporter = None
+		self.profiler = None
+
+	def start(self):
+		self.starttime = time.time()
+		if self.metrics_file == "-":
+			self.output = sys.stderr
+		elif self.metrics_file is not None:
+			self.output = open(self.metrics_file, 'a')
+		if self.output is not None and self.interval > 0:
+			self.reporter = threading.Thread(target=self.report_progress)
+			self.reporter.daemon = True
+			self.reporter.start()
+		if self.profile_file is not None:
+			self.profiler = cProfile.Profile()
+			self.profiler.enable()
+
+	def finish(self, status="ok"):
+		if self.profiler is not None:
+			self.profiler.disable()
+			self.profiler.dump_stats(self.profile_file)
+			self.profiler = None
+		if self.reporter is not None:
+			self.stopping.set()
+			self.reporter.join()
+			self.reporter = None
+		self.current_stage = None
+		if self.output is not None:
+			self.emit("summary", status=status)
+			if self.output is not sys.stderr:
+				self.output.close()
+			self.output = None
+
+	# Stages can nest: time spent in an inner stage counts towards both
+	@contextlib.contextmanager
+	def stage(self, name):
+		outer = self.current_stage
+		self.current_stage = name
+		starttime = time.time()
+		try:
+			yield
+		finally:
+			self.add_stage_time(name, time.time() - starttime)
+			self.current_stage = outer
+
+	def add_stage_time(self, name, seconds, calls=1):
+		if name not in self.stages:
+			self.stages[name] = {'seconds': 0.0, 'calls': 0}
+		self.stages[name]['seconds'] += seconds
+		self.stages[name]['calls'] += calls
+
+	def add(self, counter, n=1):
+		if counter in self.counters:
+			self.counters[counter] += n
+		else:
+			self.counters[counter] = n
+
+	def add_file_size(self, counter, filename):
+		if os.path.isfile(filename):
+			self.add(counter, os.path.getsize(filename))
+
+	# Adds in the stages and counters of another Metrics, typically one from a
+	# worker process
+	def add_totals(self, stages, counters):
+		for name, stage in stages.items():
+			self.add_stage_time(name, stage['seconds'], stage['calls'])
+		for name, n in counters.items():
+			self.add(name, n)
+
+	def snapshot(self):
+		elapsed = time.time() - self.starttime
+		counters = dict(self.counters)
+		peak, children_peak = peak_rss_mb()
+		return {
+			'script': self.script,
+			'pid': os.getpid(),
+			'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+			'elapsed': round(elapsed, 3),
+			'stage': self.current_stage,
+			'stages': dict(
+					(name, {'seconds': round(stage['seconds'], 3), 'calls': stage['calls']})
+					for name, stage in list(self.stages.items())
+			),
+			'counters': counters,
+			'per_second': dict(
+					(name, round(value / elapsed, 1) if elapsed > 0 else None)
+					for name, value in counters.items()
+			),
+			'peak_rss_mb': peak,
+			'children_peak_rss_mb': children_peak
+		}
+
+	def emit(self, event, **extra):
+		record = self.snapshot()
+		record['event'] = event
+		record.update(extra)
+		line = json.dumps(record, sort_keys=True) + "\n"
+		with self.lock:
+			self.output.write(line)
+			self.output.flush()
+
+	# Runs in a background thread, so the script doesn't have to check the time
+	def report_progress(self):
+		while not self.stopping.wait(self.interval):
+			self.emit("progress")
@@ -0,0 +1,239 @@
+#! /usr/bin/env python3
+
+# Benchmark harness for flatten.py's readers and writer
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+# Usage: benchmark_flatten.py path/to/joblist.csv
+# e.g. with a job list from generate_workbooks.py.
+#
+# For each workbook in the job list, times the stages of flattening it
+# separately:
+#	read_xls / read_xlsx: reading every row, once with each .xlsx backend
+#	write_csv: writing the rows out, from rows already read into memory
+# and records the peak memory Python allocated during each (with
+# tracemalloc, in a separate run so that it doesn't slow down the timed one).
+# The read stages stream the rows through without keeping them, as
+# flatten.py does, so their peak is what reading itself needs.
+#
+# It also checks that every .xlsx backend gives exactly the same rows, and
+# reports any workbook for which they don't. With --expected DIR, each
+# workbook's CSV (as write_csv writes it, from xlrd's rows for .xls files and
+# the first backend's for .xlsx files) is also compared with the file of the
+# same name in DIR, e.g. the flattened directory of a run you trust. The exit
+# status is 1 if anything differs, so this doubles as an equivalence test for
+# reader changes.
+#
+# Results can be saved as JSON with --results.
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import flatten
+
+
+xlsx_backends = ["openpyxl", "fastxlsx"]
+
+
+
+
+def main():
+	args = get_args()
+	flatten.verbose = False
+	inputdir = os.path.abspath(os.path.dirname(args.joblist))
+	with open(args.joblist) as jobsfile:
+		jobs = list(csv.DictReader(jobsfile))
+
+	results = []
+	mismatches = []
+	for job in jobs:
+		job["inputfile"] = os.path.join(inputdir, job["filename"])
+		ext = os.path.splitext(job["filename"])[1]
+		if ext == ".xls":
+			stages = [("read_xls", "xlrd")]
+		elif ext == ".xlsx":
+			stages = [("read_xlsx", backend) for backend in xlsx_backends]
+		else:
+			print_with_timestamp("Skipping " + job["filename"] + ", not an Excel file.")
+			continue
+
+		rows = {}
+		for stage, backend in stages:
+			job["xlsx_backend"] = backend
+			result, rows[backend] = benchmark_read(job, stage, args.repeat)
+			result["backend"] = backend
+			results.append(result)
+			report(result)
+		if len(rows) > 1 and not all_equal(list(rows.values())):
+			mismatches.append(job["filename"])
+			print_with_timestamp("MISMATCH: the .xlsx backends read " + job["filename"] + " differently.")
+
+		# the write_csv stage is given the same rows whichever reader read them
+		data = list(rows.values())[0]
+		result, matches = benchmark_write(job, data, args.repeat, args.expected)
+		results.append(result)
+		report(result)
+		if not matches:
+			mismatches.append(job["filename"])
+			print_with_timestamp("MISMATCH: " + job["filename"] + " doesn't match its file in " + args.expected)
+
+	if args.results is not None:
+		with open(args.results, 'w') as f:
+			json.dump({'date': time.strftime("%Y-%m-%dT%H:%M:%S"), 'results': results}, f, indent=1)
+		print_with_timestamp("Results saved to " + args.results)
+	if len(mismatches) > 0:
+		print_with_timestamp(str(len(mismatches)) + " workbook[s] were read differently than expected: " + ", ".join(mismatches))
+		sys.exit(1)
+	print_with_timestamp("Run complete. All backends agreed.")
+
+
+
+
+# Returns the result, and the data read ({'headers', 'rows'} with the rows as
+# a list) for comparing and for benchmark_write(). The timed and measured
+# reads only count the rows; they're read once more to keep them.
+def benchmark_read(job, stage, repeat):
+	reader = getattr(flatten, stage)
+
+	def read():
+		with quietly():
+			data = reader(dict(job))
+			return sum(1 for row in data["rows"])
+
+	seconds, rowcount = best_time(read, repeat)
+	peak = peak_memory(read)
+	with quietly():
+		data = reader(dict(job))
+		data["rows"] = list(data["rows"])
+	return stage_result(job, stage, seconds, peak, rowcount), data
+
+
+
+# Returns the result, and whether the CSV written matches the one in
+# expected_dir (always True if there isn't an expected_dir)
+def benchmark_write(job, data, repeat, expected_dir=None):
+	outputdir = tempfile.mkdtemp()
+	outputfile = os.path.join(outputdir, "output.csv")
+
+	def write():
+		flatten.write_csv(data, outputfile)
+
+	try:
+		seconds, unused = best_time(write, repeat)
+		peak = peak_memory(write)
+		result = stage_result(job, "write_csv", seconds, peak, len(data["rows"]))
+		result["output_mb"] = round(os.path.getsize(outputfile) / 1e6, 3)
+		matches = expected_dir is None or same_contents(outputfile, flatten.output_filename(job, expected_dir))
+	finally:
+		if os.path.exists(outputfile):
+			os.remove(outputfile)
+		os.rmdir(outputdir)
+	return result, matches
+
+
+
+def stage_result(job, stage, seconds, peak, rows):
+	return {
+		'filename': job["filename"],
+		'stage': stage,
+		'backend': "",
+		'rows': rows,
+		'seconds': round(seconds, 4),
+		'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+		'peak_mb': round(peak / 1e6, 2)
+	}
+
+
+
+# Runs fn repeat times, and returns the fastest time along with its result
+def best_time(fn, repeat):
+	best = None
+	for i in range(0, repeat):
+		starttime = time.perf_counter()
+		output = fn()
+		elapsed = time.perf_counter() - starttime
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, output
+
+
+
+# Peak memory allocated by Python while running fn, in bytes
+def peak_memory(fn):
+	tracemalloc.start()
+	try:
+		fn()
+		unused, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return peak
+
+
+
+def all_equal(datas):
+	first = datas[0]
+	return all(
+			data["headers"] == first["headers"] and data["rows"] == first["rows"]
+			for data in datas[1:]
+	)
+
+
+
+def same_contents(filename, expected):
+	if not os.path.isfile(expected):
+		return False
+	with open(filename, 'rb') as f, open(expected, 'rb') as g:
+		return f.read() == g.read()
+
+
+
+# flatten.py's readers print progress messages, which would drown out the results
+@contextlib.contextmanager
+def quietly():
+	with contextlib.redirect_stdout(io.StringIO()):
+		yield
+
+
+
+def report(result):
+	label = result["stage"]
+	if result["backend"] not in ["", "xlrd"]:
+		label += " (" + result["backend"] + ")"
+	print(
+			result["filename"] + "\t" + label + ":\t" + str(result["rows"]) + " rows in "
+			+ str(result["seconds"]) + "s, peak " + str(result["peak_mb"]) + " MB"
+	)
+	sys.stdout.flush()
+
+
+
+def print_with_timestamp(msg):
+	print(time.ctime() + ": " + str(msg))
+	sys.stdout.flush()
+
+
+
+def get_args():
+	parser = argparse.ArgumentParser(description="Time flatten.py's readers and writer, and check the .xlsx backends agree")
+
+# positional argument
+	parser.add_argument("joblist", help="required argument: job list of the workbooks to benchmark, in the same format flatten.py takes.")
+
+# optional arguments
+	parser.add_argument("--repeat", help="number of timed runs of each stage; the fastest counts. Default is 1.", type=int, default=1)
+	parser.add_argument("--results", help="file to save the results to, as JSON.")
+	parser.add_argument("--expected", help="directory of CSVs to compare each workbook's output with, e.g. the flattened directory of a run you trust.", metavar="DIR")
+
+	return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,476 @@
+#! /usr/bin/env python3
+
+# Minimal streaming .xlsx reader, for flatten.py
+#
+# openpyxl's read-only mode still builds a cell object for every value it
+# reads and runs each one through a chain of type checks. For flattening we
+# only ever want the values, so this reads the .xlsx zip archive directly:
+# the shared strings table is loaded once into a plain list, and the sheet
+# XML is streamed through expat, handing back each row as soon as its end tag
+# has been parsed.
+#
+# It deliberately copies the small part of openpyxl's read-only interface that
+# flatten.py uses: load_workbook(), .sheetnames, wb[name], .close(), and on
+# worksheets .max_row, .max_column, .calculate_dimension(force=True) and
+# .iter_rows(min_row, max_row, min_col, max_col, values_only=True). Values
+# come back exactly as openpyxl would return them with data_only=True:
+# ints and floats, dates as datetimes (or times, for values under one day),
+# booleans, and strings for text and errors.
+
+import datetime
+import re
+import zipfile
+from xml.etree import ElementTree
+from xml.parsers import expat
+
+
+xlsx_main_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+xlsx_rel_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+merge_cell_pattern = re.compile(br'<(?:\w+:)?mergeCell [^>]*?ref="([A-Z]+[0-9]+:[A-Z]+[0-9]+)"')
+dimension_pattern = re.compile(br'<(?:\w+:)?dimension [^>]*?ref="([A-Z]+[0-9]+(?::[A-Z]+[0-9]+)?)"')
+sheet_data_pattern = re.compile(br'<(?:\w+:)?sheetData[ />]')
+
+read_block_size = 1 << 16
+
+windows_epoch = datetime.datetime(1899, 12, 30)
+mac_epoch = datetime.datetime(1904, 1, 1)
+
+# Built in number formats that are dates or times, and the parts of a custom
+# format code that can't make it one (as in openpyxl.styles.numbers)
+builtin_date_formats = set([14, 15, 16, 17, 18, 19, 20, 21, 22, 45, 46, 47])
+format_strip_pattern = re.compile(
+		r'\[(BLACK|BLUE|CYAN|GREEN|MAGENTA|RED|WHITE|YELLOW)\]|"[^"]+"|\[\$[^\]]+\]',
+		re.IGNORECASE + re.UNICODE
+)
+iso8601_pattern = re.compile(
+		r"^(?:(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2}))?T?"
+		r"(?:(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})(?:\.(?P<ms>\d{1,6}))?)?Z?$"
+)
+
+column_numbers = {}
+local_names = {}
+
+
+
+
+def load_workbook(filename):
+	return Workbook(filename)
+
+
+
+class Workbook(object):
+
+	def __init__(self, filename):
+		self._archive = zipfile.ZipFile(filename)
+		self._paths = dict(xlsx_sheet_paths(self._archive))
+		self.sheetnames = [name for name, path in xlsx_sheet_paths(self._archive)]
+		workbook = ElementTree.fromstring(self._archive.read("xl/workbook.xml"))
+		properties = workbook.find(xlsx_main_ns + "workbookPr")
+		self.epoch = windows_epoch
+		if properties is not None and properties.get("date1904") in ("1", "true"):
+			self.epoch = mac_epoch
+		parts = xlsx_part_paths(self._archive)
+		self._shared_strings = []
+		if "sharedStrings" in parts:
+			self._shared_strings = read_shared_strings(self._archive, parts["sharedStrings"])
+		self._date_styles = set()
+		if "styles" in parts:
+			self._date_styles = read_date_styles(self._archive, parts["styles"])
+		self._sheets = {}
+
+
+	def __getitem__(self, name):
+		if name not in self._sheets:
+			if name not in self._paths:
+				raise KeyError("Worksheet {0} does not exist.".format(name))
+			self._sheets[name] = Worksheet(self, name, self._paths[name])
+		return self._sheets[name]
+
+
+	def close(self):
+		self._archive.close()
+
+
+
+class Worksheet(object):
+
+	def __init__(self, workbook, title, path):
+		self.parent = workbook
+		self.title = title
+		self._path = path
+		self.max_row = None
+		self.max_column = None
+		ref = read_dimension(workbook._archive, path)
+		if ref is not None:
+			min_col, min_row, self.max_column, self.max_row = range_boundaries(ref)
+
+
+	def calculate_dimension(self, force=False):
+		if self.max_row is None or self.max_column is None:
+			if not force:
+				raise ValueError("Worksheet is unsized, use calculate_dimension(force=True)")
+			self.max_row = 0
+			self.max_column = 0
+			for rownum, cells in self._parse_rows():
+				if len(cells) > 0:
+					self.max_row = rownum
+					self.max_column = max(self.max_column, max(cells))
+
+
+	# Like openpyxl, missing rows come back filled with None and rows with no
+	# cells at all as empty tuples. Also like openpyxl, rows after the last one
+	# in the sheet are only filled in up to max_row if the sheet has more rows
+	# after that. values_only is only there so that calls written for openpyxl
+	# work unchanged; it has to be True.
+	def iter_rows(self, min_row=None, max_row=None, min_col=None, max_col=None, values_only=True):
+		if not values_only:
+			raise ValueError("fastxlsx only reads values, so values_only must be True")
+		min_row = min_row or 1
+		min_col = min_col or 1
+		max_row = max_row or self.max_row
+		max_col = max_col or self.max_column
+		empty_row = ()
+		if max_col is not None:
+			empty_row = (None,) * (max_col + 1 - min_col)
+
+		counter = min_row
+		rownum = 0
+		rows = self._parse_rows()
+		for rownum, cells in rows:
+			if max_row is not None and rownum > max_row:
+				rows.close()
+				break
+			for i in range(counter, rownum):
+				counter += 1
+				yield empty_row
+			if counter <= rownum:
+				counter += 1
+				if len(cells) == 0:
+					yield ()
+				else:
+					width = (max_col or max(cells)) + 1 - min_col
+					values = [None] * width
+					for col, value in cells.items():
+						if min_col <= col < min_col + width:
+							values[col - min_col] = value
+					yield tuple(values)
+		if max_row is not None and max_row < rownum:
+			for i in range(counter, max_row + 1):
+				yield empty_row
+
+
+	# Streams the sheet XML, yielding (row number, {column number: value}) for
+	# each <row>. Stop iterating early to stop reading the file.
+	def _parse_rows(self):
+		shared_strings = self.parent._shared_strings
+		date_styles = self.parent._date_styles
+		epoch = self.parent.epoch
+		finished = []
+		rownum = 0
+		col = 0
+		cells = None
+		data_type = "n"
+		style = 0
+		text = None
+		collect = False
+		phonetic = False
+
+		def start(tag, attrs):
+			nonlocal rownum, col, cells, data_type, style, text, collect, phonetic
+			tag = local_names.get(tag) or local_name(tag)
+			if tag == "c":
+				ref = attrs.get("r")
+				if ref is None:
+					col += 1
+				else:
+					col = column_number(ref)
+				data_type = attrs.get("t", "n")
+				style = attrs.get("s")
+				text = None
+			elif tag == "v" or (tag == "t" and data_type == "inlineStr" and not phonetic):
+				if text is None:
+					text = []
+				collect = True
+			elif tag == "row":
+				ref = attrs.get("r")
+				if ref is None:
+					rownum += 1
+				else:
+					rownum = int(ref)
+				col = 0
+				cells = {}
+			elif tag == "rPh":
+				phonetic = True
+
+		def end(tag):
+			nonlocal collect, phonetic
+			tag = local_names.get(tag) or local_name(tag)
+			if tag == "c":
+				if text is not None:
+					is_date = style is not None and int(style) in date_styles
+					value = cell_value(data_type, text, is_date, shared_strings, epoch)
+					if value is not None:
+						cells[col] = value
+			elif tag == "v" or tag == "t":
+				collect = False
+			elif tag == "row":
+				finished.append((rownum, cells))
+			elif tag == "rPh":
+				phonetic = False
+
+		def characters(data):
+			if collect:
+				text.append(data)
+
+		parser = expat.ParserCreate()
+		parser.buffer_text = True
+		parser.StartElementHandler = start
+		parser.EndElementHandler = end
+		parser.CharacterDataHandler = characters
+		with self.parent._archive.open(self._path) as source:
+			while True:
+				block = source.read(read_block_size)
+				parser.Parse(block, block == b"")
+				for row in finished:
+					yield row
+				del finished[:]
+				if block == b"":
+					break
+
+
+
+# Converts one cell's raw text into the value openpyxl would give it
+def cell_value(data_type, text, is_date, shared_strings, epoch):
+	if text is None:
+		return None
+	text = "".join(text)
+	if data_type == "inlineStr":
+		return text
+	if text == "":
+		return None
+	if data_type == "n":
+		if "." in text or "E" in text or "e" in text:
+			value = float(text)
+		else:
+			value = int(text)
+		if is_date:
+			try:
+				return from_excel(value, epoch)
+			except (ValueError, OverflowError):
+				return "#VALUE!" # openpyxl treats out of range dates as errors too
+		return value
+	elif data_type == "s":
+		return shared_strings[int(text)]
+	elif data_type == "b":
+		return bool(int(text))
+	elif data_type == "d":
+		return from_iso8601(text)
+	return text # "str" for formula results, "e" for errors
+
+
+
+# Excel serial date to datetime, including the phantom 29 Feb 1900
+def from_excel(value, epoch=windows_epoch):
+	if 1 < value < 60 and epoch == windows_epoch:
+		value += 1
+	days, fraction = divmod(value, 1)
+	if 0 < abs(value) < 1:
+		fraction = datetime.timedelta(days=fraction)
+		minutes, seconds = divmod(fraction.seconds, 60)
+		hours, minutes = divmod(minutes, 60)
+		return datetime.time(hours, minutes, seconds, fraction.microseconds)
+	return epoch + datetime.timedelta(days=days) + datetime.timedelta(days=fraction)
+
+
+
+def from_iso8601(text):
+	match = iso8601_pattern.match(text)
+	if not match:
+		raise ValueError("Invalid datetime value {}".format(text))
+	parts = dict((k, int(v)) for k, v in match.groupdict().items() if v is not None)
+	if "year" not in parts:
+		value = datetime.time(parts["hour"], parts["minute"], parts["second"])
+	elif "hour" not in parts:
+		value = datetime.date(parts["year"], parts["month"], parts["day"])
+	else:
+		value = datetime.datetime(
+				parts["year"], parts["month"], parts["day"],
+				parts["hour"], parts["minute"], parts["second"]
+		)
+	if "ms" in parts:
+		value += datetime.timedelta(microseconds=parts["ms"])
+	return value
+
+
+
+# Element names without any namespace prefix, cached since there are only a few
+def local_name(tag):
+	local_names[tag] = tag.rpartition(":")[2]
+	return local_names[tag]
+
+
+
+# "BC12" -> 55, cached by column letters since a sheet only has a few of them
+def column_number(ref):
+	letters = ref.rstrip("0123456789")
+	number = column_numbers.get(letters)
+	if number is None:
+		number = 0
+		for letter in letters:
+			number = number * 26 + ord(letter) - 64
+		column_numbers[letters] = number
+	return number
+
+
+
+# "A1:C5" -> (1, 1, 3, 5), in openpyxl's (min_col, min_row, max_col, max_row) order
+def range_boundaries(ref):
+	first, sep, last = ref.partition(":")
+	if last == "":
+		last = first
+	return (
+			column_number(first), int(first.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ")),
+			column_number(last), int(last.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+	)
+
+
+
+# Returns [(sheet name, path within the zip archive)] in workbook order
+def xlsx_sheet_paths(archive):
+	targets = xlsx_relationships(archive)
+	sheets = []
+	workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+	for sheet in workbook.iter(xlsx_main_ns + "sheet"):
+		sheets.append((sheet.get("name"), targets[sheet.get(xlsx_rel_ns + "id")][1]))
+	return sheets
+
+
+
+# The workbook's other parts by relationship type, e.g. {"styles": "xl/styles.xml"}
+def xlsx_part_paths(archive):
+	parts = {}
+	for rel_type, target in xlsx_relationships(archive).values():
+		parts[rel_type.rpartition("/")[2]] = target
+	return parts
+
+
+
+# {relationship id: (type, path within the zip archive)} for xl/workbook.xml
+def xlsx_relationships(archive):
+	targets = {}
+	rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+	for rel in rels:
+		target = rel.get("Target")
+		if target.startswith("/"):
+			target = target[1:]
+		else:
+			target = "xl/" + target
+		targets[rel.get("Id")] = (rel.get("Type", ""), target)
+	return targets
+
+
+
+# <mergeCells> lives after all the cell data, so rather than parse the whole
+# sheet we scan the raw bytes for it, a block at a time.
+def scan_merged_cells(archive, path):
+	ranges = []
+	leftover = b""
+	with archive.open(path) as source:
+		while True:
+			block = source.read(1 << 20)
+			text = leftover + block
+			if block == b"":
+				cut = len(text)
+			else:
+				cut = max(text.rfind(b"<"), 0) # so no tag is split between blocks
+			ranges.extend(r.decode("ascii") for r in merge_cell_pattern.findall(text, 0, cut))
+			leftover = text[cut:]
+			if block == b"":
+				break
+	return ranges
+
+
+
+# <dimension> comes before the cell data, so we only need to read until that starts
+def read_dimension(archive, path):
+	text = b""
+	with archive.open(path) as source:
+		while True:
+			block = source.read(read_block_size)
+			text += block
+			match = dimension_pattern.search(text)
+			if match is not None:
+				return match.group(1).decode("ascii")
+			if block == b"" or sheet_data_pattern.search(text) is not None:
+				return None
+
+
+
+# The shared strings table as a plain list, rich text runs joined up and
+# phonetic guides left out
+def read_shared_strings(archive, path):
+	strings = []
+	state = {'parts': None, 'collect': False, 'phonetic': False}
+
+	def start(tag, attrs):
+		tag = tag.rpartition(":")[2]
+		if tag == "si":
+			state["parts"] = []
+		elif tag == "t" and not state["phonetic"]:
+			state["collect"] = True
+		elif tag == "rPh":
+			state["phonetic"] = True
+
+	def end(tag):
+		tag = tag.rpartition(":")[2]
+		if tag == "si":
+			strings.append("".join(state["parts"]).replace("x005F_", ""))
+		elif tag == "t":
+			state["collect"] = False
+		elif tag == "rPh":
+			state["phonetic"] = False
+
+	def characters(data):
+		if state["collect"]:
+			state["parts"].append(data)
+
+	parser = expat.ParserCreate()
+	parser.buffer_text = True
+	parser.StartElementHandler = start
+	parser.EndElementHandler = end
+	parser.CharacterDataHandler = characters
+	with archive.open(path) as source:
+		parser.ParseFile(source)
+	return strings
+
+
+
+# Indexes of the cell styles (the s="..." attribute on cells) whose number
+# format is a date or time
+def read_date_styles(archive, path):
+	styles = ElementTree.fromstring(archive.read(path))
+	custom_formats = {}
+	numfmts = styles.find(xlsx_main_ns + "numFmts")
+	if numfmts is not None:
+		for numfmt in numfmts.findall(xlsx_main_ns + "numFmt"):
+			custom_formats[int(numfmt.get("numFmtId"))] = numfmt.get("formatCode")
+	date_styles = set()
+	cellxfs = styles.find(xlsx_main_ns + "cellXfs")
+	if cellxfs is not None:
+		for i, xf in enumerate(cellxfs.findall(xlsx_main_ns + "xf")):
+			numfmt_id = int(xf.get("numFmtId", 0))
+			if numfmt_id in custom_formats:
+				if is_date_format(custom_formats[numfmt_id]):
+					date_styles.add(i)
+			elif numfmt_id in builtin_date_formats:
+				date_styles.add(i)
+	return date_styles
+
+
+
+def is_date_format(fmt):
+	if fmt is None:
+		return False
+	fmt = fmt.split(";")[0] # only look at the first format
+	fmt = format_strip_pattern.sub("", fmt)
+	return re.search("[dmhysDMHYS]", fmt) is not None
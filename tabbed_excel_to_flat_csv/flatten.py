@@ -18,18 +18,68 @@ __author__ = "Eldan Goldenberg, February 2017 - May 2018"
 # notes: optional human-readable notes, ignored by the script
 #
 # Then simply: flatten.py path/to/joblist.csv
+# or, to flatten several workbooks at once: flatten.py --jobs 4 path/to/joblist.csv
+# Workbooks that haven't changed since the last run are skipped, according to
+# the manifest kept in the output directory. Use --force to redo everything.
+# Add --merge to also combine all the flattened CSVs into one, and --compress
+# to write them all compressed.
+# --output-format sqlite or parquet writes typed output instead of CSVs, for
+# loading straight into a database or dataframe.
+# --watch keeps running, and re-flattens workbooks as they change: see watch().
+# --metrics FILE writes progress and a summary as JSON lines, with the time
+# spent reading and writing workbooks, and --profile FILE saves cProfile
+# stats: see instrumentation.py in the parent directory.
 
 import argparse
+import bisect
+import concurrent.futures
+import contextlib
 import csv
-import openpyxl	# for newer-style .xlsx files
+import datetime
+import fastxlsx	# our own faster .xlsx reader
+import hashlib
+import io
+import itertools
+import json
+import operator
 import os
+import signal
+import sqlite3
 import sys
+import threading
 import time
-import xlrd	 		# for old-style .xls files
+import traceback
+import zipfile
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import compressed_io	# shared with the scripts in the parent directory
+import instrumentation	# also shared; --metrics and --profile
+import fast_csv		# also shared; fast CSV writing, and lazy imports
+
+# Only loaded once there's a workbook of their kind to read, so --help, skipped
+# jobs and --watch waiting for changes don't wait for them
+openpyxl = fast_csv.lazy_import("openpyxl")	# for newer-style .xlsx files
+xlrd = fast_csv.lazy_import("xlrd")			# for old-style .xls files
 
 
 verbose = True
 output_subdir = "flattened"
+manifest_filename = "flatten_manifest.json"
+status_filename = "flatten_status.json"
+merge_source_column = "source_file"
+sqlite_filename = "flattened.sqlite"
+sqlite_batch_size = 10000
+output_extensions = {
+	'csv': ".csv",
+	'parquet': ".parquet"
+}
+# job list columns that affect the output, so changing one means re-flattening
+fingerprint_params = ["header", "subheader", "tabs", "skip_tabs", "column_wrap"]
+
+dense_merge_limit = 100000
+
+# --watch writes its status file from two threads
+status_lock = threading.Lock()
 
 
 
@@ -39,13 +89,15 @@ def main():
 	print_with_timestamp("Starting run.")
 	starttime = time.time()
 
-	inputdir = os.path.abspath(os.path.dirname(args.joblist))
-	outputdir = os.path.join(inputdir, output_subdir)
-	if not os.path.isdir(outputdir):
-		os.mkdir(outputdir)
-
-	filecount = process_job_list(inputdir, outputdir, args.joblist)
-
+	with instrumentation.run("flatten", args) as metrics:
+		inputdir = os.path.abspath(os.path.dirname(args.joblist))
+		outputdir = os.path.join(inputdir, output_subdir)
+		if not os.path.isdir(outputdir):
+			os.mkdir(outputdir)
+		if args.watch:
+			filecount = watch(args, inputdir, outputdir, metrics)
+		else:
+			filecount = flatten_batch(args, inputdir, outputdir, metrics, args.force)
 	print_with_timestamp(
 			"Run complete. " + str(filecount) + " files processed in "
 			+ elapsed_time(starttime) + "."
@@ -54,59 +106,653 @@ def main():
 
 
 
-def process_job_list(inputdir, outputdir, joblist):
+# One pass through the job list, merging the results afterwards if asked.
+# Returns the number of files flattened.
+def flatten_batch(args, inputdir, outputdir, metrics, force, pool=None):
+	filecount, failures, skipped = process_job_list(
+			inputdir, outputdir, args.joblist, args.jobs, force, args.hash,
+			args.xlsx_backend, args.output_format, args.compress, metrics, pool
+	)
+
+	if skipped > 0:
+		print_with_timestamp(str(skipped) + " file[s] skipped because they haven't changed since the last run.")
+	if failures > 0:
+		print_with_timestamp(str(failures) + " file[s] could not be processed, see errors above.")
+	if args.merge:
+		if args.output_format != "csv":
+			print_with_timestamp("--merge only works with CSV output, so not merging.")
+		else:
+			mergefile = os.path.splitext(os.path.basename(args.joblist))[0] + "_merged.csv"
+			if args.compress is not None:
+				mergefile += "." + args.compress
+			with metrics.stage("merge"):
+				merge_outputs(outputdir, args.joblist, os.path.join(inputdir, mergefile), args.compress, metrics)
+	return filecount
+
+
+
+
+# Watch mode: flattens whatever needs it, as a normal run would, and then
+# keeps checking the job list and the files it names for changes every
+# --poll-interval seconds. Once something has changed and then been left
+# alone for --debounce seconds, so that a burst of saves or a file still being
+# copied in only sets off one batch, it runs another batch, which as always
+# only re-flattens the jobs whose files or job list rows have changed. Runs
+# until stopped with Ctrl-C.
+# The worker pool, and all the modules flatten.py has loaded, stay warm from
+# one batch to the next, so each batch starts straight away. It polls rather
+# than relying on OS file change notifications, so that it works the same on
+# every platform and on network drives.
+# The queue and the last batch's timings are kept up to date in
+# status_filename in the output directory: see write_status().
+def watch(args, inputdir, outputdir, metrics):
+	status = {
+		'pid': os.getpid(),
+		'state': "starting",
+		'pending': [],
+		'batches': 0,
+		'files_flattened': 0,
+		'current_batch': None,
+		'last_batch': None
+	}
+	if args.jobs > 1:
+		pool = watch_pool(args.jobs)
+	else:
+		pool = None
+	stopping = threading.Event()
+	reporter = threading.Thread(target=report_status, args=(outputdir, status, stopping, args.poll_interval))
+	reporter.daemon = True
+	reporter.start()
+
+	try:
+		signature = watch_signature(args.joblist, inputdir)
+		force = args.force
+		lastchange = time.time() - args.debounce # so the first batch runs straight away
+		while True:
+			if lastchange is not None and time.time() - lastchange >= args.debounce:
+				try:
+					watch_batch(args, inputdir, outputdir, metrics, force, pool, status)
+					broken = status["last_batch"]["worker_crashes"] > 0
+				except Exception:
+					# keep watching: the next change may well fix it. The pool may be broken, so start a fresh one.
+					print_with_timestamp("Batch failed:")
+					print(traceback.format_exc())
+					broken = True
+				if broken and pool is not None:
+					pool.shutdown()
+					pool = watch_pool(args.jobs)
+				force = False
+				lastchange = None
+				status["state"] = "watching"
+				write_status(outputdir, status)
+				print_if_verbose("Watching " + args.joblist + " for changes. Press Ctrl-C to stop.")
+			time.sleep(args.poll_interval)
+			current = watch_signature(args.joblist, inputdir)
+			changed = sorted(name for name in set(signature) | set(current) if signature.get(name) != current.get(name))
+			if len(changed) > 0:
+				print_if_verbose("Changed: " + ", ".join(changed))
+				signature = current
+				lastchange = time.time()
+				status["pending"] = sorted(set(status["pending"]) | set(changed))
+				status["state"] = "debouncing"
+				write_status(outputdir, status)
+	except KeyboardInterrupt:
+		print_with_timestamp("Stopped watching.")
+	finally:
+		stopping.set()
+		reporter.join()
+		if pool is not None:
+			pool.shutdown(cancel_futures=True)
+		status["state"] = "stopped"
+		status["current_batch"] = None
+		write_status(outputdir, status)
+	return status["files_flattened"]
+
+
+
+# Ctrl-C goes to the workers as well as to watch(), which stops them itself
+def watch_pool(njobs):
+	return concurrent.futures.ProcessPoolExecutor(max_workers=njobs, initializer=ignore_interrupts)
+
+
+
+def ignore_interrupts():
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+
+# Runs one batch for watch(), recording it in status, and adding its stages and
+# counters into the run's metrics
+def watch_batch(args, inputdir, outputdir, metrics, force, pool, status):
+	batch_metrics = instrumentation.Metrics("flatten")
+	batch = {
+		'started': time.strftime("%Y-%m-%dT%H:%M:%S"),
+		'metrics': batch_metrics
+	}
+	status["current_batch"] = batch
+	status["pending"] = []
+	status["state"] = "flattening"
+	write_status(outputdir, status)
+	starttime = time.time()
+	try:
+		status["files_flattened"] += flatten_batch(args, inputdir, outputdir, batch_metrics, force, pool)
+	finally:
+		metrics.add_totals(batch_metrics.stages, batch_metrics.counters)
+		counters = batch_metrics.counters
+		status["batches"] += 1
+		status["current_batch"] = None
+		status["last_batch"] = {
+			'started': batch["started"],
+			'seconds': round(time.time() - starttime, 3),
+			'queued': counters.get("queued", 0),
+			'flattened': counters.get("workbooks", 0),
+			'failed': counters.get("failures", 0),
+			'skipped': counters.get("skipped", 0),
+			'rows': counters.get("rows", 0),
+			'worker_crashes': counters.get("worker_crashes", 0),
+			'stages': dict(
+					(name, round(stage["seconds"], 3))
+					for name, stage in batch_metrics.stages.items()
+			)
+		}
+
+
+
+# The size and modification time of the job list and of every file it names,
+# to tell cheaply whether anything has changed. A missing file, or a job list
+# that can't be read (say because it's half saved), just looks like a change.
+def watch_signature(joblist, inputdir):
+	signature = {os.path.basename(joblist): file_signature(joblist)}
+	try:
+		with open(joblist) as jobsfile:
+			for job in csv.DictReader(jobsfile):
+				signature[job["filename"]] = file_signature(os.path.join(inputdir, job["filename"]))
+	except (OSError, csv.Error, KeyError, TypeError):
+		pass
+	return signature
+
+
+
+def file_signature(path):
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return [stat.st_size, stat.st_mtime_ns]
+
+
+
+# Runs in a background thread, so the status file keeps up with the queue
+# while a batch is running
+def report_status(outputdir, status, stopping, interval):
+	while not stopping.wait(interval):
+		write_status(outputdir, status)
+
+
+
+# The status file is JSON:
+# state: starting, flattening, watching (for changes), debouncing (waiting for
+#	changes to settle down) or stopped
+# pending: files (including the job list) changed since the last batch started
+# queue_depth: how many jobs are waiting: the pending files, plus the jobs in
+#	the current batch that haven't finished yet
+# current_batch: when it started, and how many jobs it has queued and finished
+# last_batch: when it started, how long it took, how many jobs it flattened,
+#	failed on and skipped, how many rows it wrote, and the seconds spent in
+#	each stage
+# batches and files_flattened: totals since the watch started
+def write_status(outputdir, status):
+	with status_lock:
+		record = dict(status)
+		record["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+		queue_depth = len(status["pending"])
+		batch = status["current_batch"]
+		if batch is not None:
+			queued = batch["metrics"].counters.get("queued", 0)
+			finished = batch["metrics"].counters.get("finished", 0)
+			record["current_batch"] = {'started': batch["started"], 'queued': queued, 'finished': finished}
+			queue_depth += queued - finished
+		record["queue_depth"] = queue_depth
+		path = os.path.join(outputdir, status_filename)
+		with open(path + ".tmp", 'w') as statusfile:
+			json.dump(record, statusfile, indent=1, sort_keys=True)
+		os.replace(path + ".tmp", path)
+
+
+
+
+# With njobs > 1 the workbooks are flattened in a pool of worker processes.
+# Each job's log is printed as one block, in job list order, as soon as it
+# and every job before it have finished.
+# Jobs whose input file and job list parameters are the same as in the last
+# run's manifest are skipped, unless force is set.
+# Each job times its own stages, which are added into metrics as it finishes.
+# An existing pool can be passed in to be used instead, and is left running.
+# If a worker process dies (see pooled_results()) that pool is no use any more,
+# and metrics' worker_crashes counter says so.
+def process_job_list(
+		inputdir, outputdir, joblist, njobs=1, force=False, use_hash=False,
+		xlsx_backend="openpyxl", output_format="csv", compression=None,
+		metrics=None, pool=None
+):
+	if metrics is None:
+		metrics = instrumentation.Metrics("flatten")
 	filecount = 0
+	failures = 0
 	print_if_verbose("Opening " + joblist)
 	with open(joblist) as jobsfile:
-		jobs = csv.DictReader(jobsfile)
-		for job in jobs:
-			ext = os.path.splitext(job["filename"])[1]
-			job["inputfile"] = os.path.join(inputdir, job["filename"])
-			outputfile = os.path.join(
-					outputdir,
-					os.path.basename(job["filename"]).replace(ext, ".csv")
-			)
-			if ext == ".xls":
-				write_csv(read_xls(job), outputfile)
-				filecount += 1
-			elif ext == ".xlsx":
-				write_csv(read_xlsx(job), outputfile)
+		jobs = list(csv.DictReader(jobsfile))
+	manifest = read_manifest(outputdir)
+	todo = []
+	fingerprints = {}
+	for job in jobs:
+		job["inputfile"] = os.path.join(inputdir, job["filename"])
+		job["xlsx_backend"] = xlsx_backend
+		job["output_format"] = output_format
+		job["typed"] = output_format != "csv"
+		job["compression"] = compression
+		if os.path.isfile(job["inputfile"]):
+			fingerprints[job["filename"]] = job_fingerprint(job, use_hash)
+		if (
+				not force
+				and job["filename"] in fingerprints
+				and job_unchanged(manifest, job, fingerprints[job["filename"]], outputdir)
+		):
+			print_if_verbose("Skipping " + job["filename"] + ", unchanged since the last run.")
+		else:
+			todo.append(job)
+	skipped = len(jobs) - len(todo)
+	metrics.add("skipped", skipped)
+	metrics.add("queued", len(todo))
+
+	own_pool = None
+	if pool is None and njobs > 1:
+		pool = own_pool = concurrent.futures.ProcessPoolExecutor(max_workers=njobs)
+	if pool is not None:
+		results = pooled_results(pool, todo, outputdir, njobs, metrics)
+	else:
+		results = (run_job(job, outputdir) for job in todo)
+	try:
+		for result in results:
+			metrics.add("finished")
+			metrics.add_totals(result["stages"], result["counters"])
+			if result["log"] != "":
+				print(result["log"], end="")
+				sys.stdout.flush()
+			if result["error"] is not None:
+				failures += 1
+				metrics.add("failures")
+				manifest.pop(result["filename"], None)
+				print_with_timestamp(
+						"Failed on " + result["filename"] + " after "
+						+ format_duration(result["seconds"]) + ":"
+				)
+				print(result["error"])
+			elif result["written"]:
 				filecount += 1
+				metrics.add("workbooks")
+				manifest[result["filename"]] = fingerprints[result["filename"]]
+	finally:
+		results.close()
+		if own_pool is not None:
+			own_pool.shutdown()
+		write_manifest(outputdir, manifest, jobs)
+	report_orphans(outputdir, jobs)
+	return filecount, failures, skipped
+
+
+
+# Runs the jobs in pool, and yields their results in job order.
+# run_job() catches any error in flattening a workbook, but if a worker process
+# dies altogether (killed for running out of memory, say, or a crash inside
+# xlrd or openpyxl) the pool breaks, and every job in it that hadn't finished
+# fails with it. There's no telling which job killed it, so the first
+# unfinished one is run again in a pool of its own: if that dies too, it's
+# recorded as that job's failure. Either way, the other unfinished jobs go on
+# in a new pool. So each crash settles one job, and no job is lost or blamed
+# for another's crash.
+def pooled_results(pool, jobs, outputdir, njobs, metrics):
+	futures = [pool.submit(run_job, job, outputdir, True) for job in jobs]
+	own_pool = None
+	try:
+		for i, job in enumerate(jobs):
+			try:
+				result = futures[i].result()
+			except concurrent.futures.process.BrokenProcessPool:
+				metrics.add("worker_crashes")
+				print_with_timestamp("A worker process died while " + job["filename"] + " or a job alongside it was being flattened. Trying " + job["filename"] + " again on its own.")
+				concurrent.futures.wait(futures[i + 1:]) # they'll all have finished or failed by now, but not necessarily been told so
+				result = isolated_result(job, outputdir)
+				if own_pool is not None:
+					own_pool.shutdown()
+				pool = own_pool = concurrent.futures.ProcessPoolExecutor(max_workers=njobs)
+				for j in range(i + 1, len(jobs)):
+					if isinstance(futures[j].exception(), concurrent.futures.process.BrokenProcessPool):
+						futures[j] = pool.submit(run_job, jobs[j], outputdir, True)
+			except Exception:
+				result = failed_result(job, traceback.format_exc())
+			yield result
+	finally:
+		if own_pool is not None:
+			own_pool.shutdown(cancel_futures=True)
+
+
+
+def isolated_result(job, outputdir):
+	solo = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+	try:
+		return solo.submit(run_job, job, outputdir, True).result()
+	except concurrent.futures.process.BrokenProcessPool:
+		return failed_result(job, "The worker process died while flattening it, probably by running out of memory or crashing inside the Excel reader.\n")
+	except Exception:
+		return failed_result(job, traceback.format_exc())
+	finally:
+		solo.shutdown()
+
+
+
+# The result of a job that run_job() couldn't report on itself
+def failed_result(job, error):
+	return {
+		'filename': job["filename"],
+		'written': False,
+		'error': error,
+		'seconds': 0,
+		'log': "",
+		'stages': {},
+		'counters': {}
+	}
+
+
+
+# Combines the flattened CSVs of every job in the list into a single CSV, in
+# job list order, with a merge_source_column naming the workbook each row
+# came from. A first pass reads only the header row of each file to build the
+# union of all their columns, in the order they're first seen; the second
+# streams the rows through one at a time, leaving columns a file doesn't have
+# empty, so memory use doesn't grow with the size of the files.
+# compression has to be what the jobs were flattened with, so that their
+# output files are found.
+def merge_outputs(outputdir, joblist, mergefile, compression=None, metrics=None):
+	if metrics is None:
+		metrics = instrumentation.Metrics("flatten")
+	starttime = time.time()
+	with open(joblist) as jobsfile:
+		jobs = list(csv.DictReader(jobsfile))
+	# if two jobs share an output file (say a.xls and a.xlsx), the later one wrote it
+	outputs = {}
+	for job in jobs:
+		job["output_format"] = "csv"
+		job["compression"] = compression
+		filename = output_filename(job, outputdir)
+		if os.path.splitext(job["filename"])[1] in (".xls", ".xlsx") and os.path.isfile(filename):
+			outputs[filename] = job["filename"]
+	sources = [(source, filename) for filename, source in outputs.items()]
+	print_if_verbose("Merging " + str(len(sources)) + " flattened file[s] into " + mergefile)
+
+	columns = [merge_source_column]
+	positions = {}
+	for source, filename in sources:
+		for name in read_csv_header(filename):
+			if name not in positions:
+				positions[name] = len(columns)
+				columns.append(name)
+	# a data column with the same name as merge_source_column keeps its own
+	# place, under the first free name of the form source_file_1
+	if merge_source_column in positions:
+		n = 1
+		while merge_source_column + "_" + str(n) in positions:
+			n += 1
+		columns[positions[merge_source_column]] = merge_source_column + "_" + str(n)
+
+	rowcount = 0
+	partfile = os.path.join(os.path.dirname(mergefile), "partial_" + os.path.basename(mergefile)) # same extension, so same compression
+	with compressed_io.open_file(partfile, 'w') as outfile:
+		writer = csv.writer(outfile)
+		writer.writerow(columns)
+		for source, filename in sources:
+			with compressed_io.open_file(filename, 'r', newline="") as infile:
+				reader = csv.reader(infile)
+				placement = [positions[name] for name in next(reader, [])]
+				for row in reader:
+					merged = [""] * len(columns)
+					merged[0] = source
+					for value, position in zip(row, placement):
+						merged[position] = value
+					writer.writerow(merged)
+					rowcount += 1
+	os.replace(partfile, mergefile)
+	metrics.add("merged_rows", rowcount)
+	print_with_timestamp(
+			"Merged " + str(rowcount) + " rows with " + str(len(columns)) + " columns into "
+			+ mergefile + " in " + elapsed_time(starttime) + "."
+	)
+
+
+
+def read_csv_header(filename):
+	with compressed_io.open_file(filename, 'r', newline="") as infile:
+		return next(csv.reader(infile), [])
+
+
+
+# The manifest records, for each input file that was flattened successfully,
+# what it and its job list row looked like at the time. It lives in the
+# output directory as JSON: {filename: fingerprint}
+def read_manifest(outputdir):
+	path = os.path.join(outputdir, manifest_filename)
+	if not os.path.isfile(path):
+		return {}
+	with open(path) as manifestfile:
+		return json.load(manifestfile)
+
+
+
+# Entries for files that have dropped out of the job list are discarded
+def write_manifest(outputdir, manifest, jobs):
+	current = set(job["filename"] for job in jobs)
+	for filename in list(manifest.keys()):
+		if filename not in current:
+			del manifest[filename]
+	path = os.path.join(outputdir, manifest_filename)
+	with open(path + ".tmp", 'w') as manifestfile:
+		json.dump(manifest, manifestfile, indent=1, sort_keys=True)
+	os.replace(path + ".tmp", path)
+
+
+
+# A job's fingerprint: the size and either the mtime or (with use_hash) the
+# SHA-1 of its input file, plus a hash of the job list parameters that
+# change the output
+def job_fingerprint(job, use_hash=False):
+	stat = os.stat(job["inputfile"])
+	params = [job.get(key, "") for key in fingerprint_params]
+	fingerprint = {
+		'size': stat.st_size,
+		'params': hashlib.sha1(json.dumps(params).encode("utf-8")).hexdigest(),
+		'output': os.path.basename(output_filename(job, ""))
+	}
+	if use_hash:
+		digest = hashlib.sha1()
+		with open(job["inputfile"], 'rb') as infile:
+			for block in iter(lambda: infile.read(1 << 20), b""):
+				digest.update(block)
+		fingerprint["sha1"] = digest.hexdigest()
+	else:
+		fingerprint["mtime"] = stat.st_mtime
+	return fingerprint
+
+
+
+def job_unchanged(manifest, job, fingerprint, outputdir):
+	previous = manifest.get(job["filename"])
+	if previous is None or not os.path.isfile(output_filename(job, outputdir)):
+		return False
+	if job.get("output_format") == "sqlite":
+		if not sqlite_has_table(output_filename(job, outputdir), output_table_name(job)):
+			return False
+	for key in fingerprint:
+		if previous.get(key) != fingerprint[key]:
+			return False
+	return True
+
+
+
+# Lists files in the output directory that no job in the list produces,
+# e.g. left over from workbooks that have since been taken off the list
+def report_orphans(outputdir, jobs):
+	expected = set(os.path.basename(output_filename(job, outputdir)) for job in jobs)
+	expected.add(manifest_filename)
+	expected.add(status_filename)
+	orphans = sorted(f for f in os.listdir(outputdir) if f not in expected)
+	if len(orphans) > 0:
+		print_with_timestamp("These files in " + outputdir + " don't belong to any job in the list:")
+		for f in orphans:
+			print("\t" + f)
+
+
+
+# With the sqlite output format every job writes to the same database file,
+# each into its own table
+def output_filename(job, outputdir):
+	if job.get("output_format") == "sqlite":
+		return os.path.join(outputdir, sqlite_filename)
+	ext = os.path.splitext(job["filename"])[1]
+	newext = output_extensions[job.get("output_format", "csv")]
+	if job.get("output_format", "csv") == "csv" and job.get("compression") is not None:
+		newext += "." + job["compression"]
+	return os.path.join(
+			outputdir,
+			os.path.basename(job["filename"]).replace(ext, newext)
+	)
+
+
+
+def output_table_name(job):
+	return os.path.splitext(os.path.basename(job["filename"]))[0]
+
+
+
+# Flattens one workbook, catching any error so that one bad file can't stop
+# the rest of the run. With capture_log everything it would have printed is
+# returned in result["log"] instead, for the parent process to print.
+def run_job(job, outputdir, capture_log=False):
+	result = {
+		'filename': job["filename"],
+		'written': False,
+		'error': None,
+		'seconds': 0,
+		'log': "",
+		'stages': {},
+		'counters': {}
+	}
+	metrics = instrumentation.Metrics("flatten")
+	log = io.StringIO()
+	starttime = time.time()
+	with contextlib.ExitStack() as stack:
+		if capture_log:
+			stack.enter_context(contextlib.redirect_stdout(log))
+		ext = os.path.splitext(job["filename"])[1]
+		outputfile = output_filename(job, outputdir)
+		try:
+			if ext == ".xls" or ext == ".xlsx":
+				with metrics.stage("read"):
+					if ext == ".xls":
+						data = read_xls(job)
+					else:
+						data = read_xlsx(job)
+				# the data rows are only read as they're written, so the write stage includes reading them.
+				# They're counted by zipping them with a counter, all in C, so counting doesn't add a
+				# Python call per row; the count is the counter's next value once they've all been read.
+				tally = itertools.count()
+				data["rows"] = map(operator.itemgetter(0), zip(data["rows"], tally))
+				with metrics.stage("write"):
+					write_output(data, outputfile, job)
+				metrics.add("rows", next(tally))
+				result["written"] = True
+				metrics.add_file_size("input_bytes", job["inputfile"])
 			else:
 				print("File extension " + ext + " not recognised, skipping row:")
 				print(job)
-	return filecount
+		except Exception:
+			result["error"] = traceback.format_exc()
+			# don't leave a partly written file behind (write_sqlite tidies up after itself)
+			if job.get("output_format") != "sqlite" and os.path.exists(outputfile):
+				os.remove(outputfile)
+		result["seconds"] = time.time() - starttime
+		result["stages"] = metrics.stages
+		result["counters"] = metrics.counters
+		if result["written"]:
+			print_if_verbose(
+					"Finished " + job["filename"] + " in "
+					+ format_duration(result["seconds"]) + "."
+			)
+	result["log"] = log.getvalue()
+	return result
 
 
 
+# Reading happens in two phases. read_xls() and read_xlsx() only look at the
+# header and subheader rows of each tab, which fixes the set of columns for
+# the output file. data["rows"] is then a generator that reads the data rows
+# one at a time as write_csv() asks for them, so no more than one row is ever
+# held in memory.
 def read_xls(job):
 	print_with_timestamp("Processing " + job["filename"])
-	ntabs = 0
 	data = {
 		'headers': [],
-		'rows': []
+		'rows': None
 	}
-	with xlrd.open_workbook(job["inputfile"]) as workbook:
-		if job["tabs"] == "":
-			data = read_xls_sheet(workbook.sheet_by_index(0), data, job)
-			ntabs = 1
-		else:
-			data["headers"].append(job["tabs"])
-			for sheet in workbook.sheets():
-				if job["skip_tabs"] != "":
-					if job["skip_tabs"] == 1:
-						job["skip_tabs"] = ""
-					else:
-						job["skip_tabs"] -= 1
-				else:
-					data = read_xls_sheet(sheet, data, job)
-					ntabs += 1
-	print_with_timestamp(str(ntabs) + " tab[s] read")
+	known_headers = set()
+	# on_demand means each sheet is only parsed when we ask for it, so tabs
+	# that skip_tabs leaves out are never parsed at all
+	workbook = xlrd.open_workbook(job["inputfile"], on_demand=True)
+	if job["tabs"] == "":
+		sheet_indexes = [0]
+	else:
+		add_headers(data, known_headers, [job["tabs"]])
+		if job["skip_tabs"] == "":
+			job["skip_tabs"] = 0
+		sheet_indexes = range(int(job["skip_tabs"]), workbook.nsheets)
+
+	# xlrd's sheets hold every cell, so keeping them all loaded until their
+	# rows had been streamed would hold the whole workbook in memory. Instead
+	# each sheet after the first is unloaded again as soon as its header has
+	# been read, and parsed again when its rows are wanted. The first one is
+	# read next anyway, so it stays, and a single tab is only parsed once.
+	layouts = []
+	for i in sheet_indexes:
+		layout = read_xls_header(workbook.sheet_by_index(i), job)
+		if len(layouts) > 0:
+			workbook.unload_sheet(i)
+			layout["sheet"] = None
+		layout["index"] = i
+		layout["datemode"] = workbook.datemode
+		add_headers(data, known_headers, layout["col_names"])
+		layouts.append(layout)
+	data["rows"] = stream_xls_rows(workbook, layouts, job)
 	return data
 
 
 
-def read_xls_sheet(sheet, data, job):
+# Each sheet that read_xls() unloaded is loaded again when its rows are
+# wanted, and every sheet is unloaded as soon as they've all been read
+def stream_xls_rows(workbook, layouts, job):
+	try:
+		for layout in layouts:
+			if layout["sheet"] is None:
+				layout["sheet"] = workbook.sheet_by_index(layout["index"])
+			for content in read_xls_sheet(layout, job):
+				yield content
+			layout["sheet"] = None
+			workbook.unload_sheet(layout["index"])
+	finally:
+		workbook.release_resources()
+	print_with_timestamp(str(len(layouts)) + " tab[s] read")
+
+
+
+def read_xls_header(sheet, job):
 	header = int(job["header"]) - 1 # -1 because xlrd is 0-indexed while Excel itself is 1-indexed in the UI
 	if job["subheader"] == "":
 		subheader = None
@@ -126,72 +772,136 @@ def read_xls_sheet(sheet, data, job):
 			nframes = sheet.ncols // ncols
 	prev_head = ""
 	col_names = []
+	header_values = sheet.row_values(header, 0, ncols)
+	if subheader is not None:
+		subheader_values = sheet.row_values(subheader, 0, ncols)
 
 	for col in range(0, ncols):
 		if subheader is None:
-			val = sheet.cell_value(header, col)
+			val = header_values[col]
 		else:
-			if sheet.cell_value(header, col) != "":
-				prev_head = sheet.cell_value(header, col)
-			if sheet.cell_value(subheader, col) == "":
+			if header_values[col] != "":
+				prev_head = header_values[col]
+			if subheader_values[col] == "":
 				val = prev_head
 			else:
-				val = prev_head + ": " + str(sheet.cell_value(subheader, col))
+				val = prev_head + ": " + str(subheader_values[col])
+		if val == "":
+			val = None
 		col_names.append(val)
 
-	for val in col_names:
-		if val != "" and val not in data["headers"]:
-			data["headers"].append(val)
+	return {
+		'sheet': sheet,
+		'col_names': col_names,
+		'ncols': ncols,
+		'nframes': nframes,
+		'firstrow': firstrow
+	}
+
+
 
-	for frame in range(0, nframes):
-		for row in range(firstrow, sheet.nrows):
+# Reads whole rows at a time with row_values(), sliced to the current frame.
+# The last frame of a column_wrap sheet can be narrower than the others, in
+# which case its missing columns are left blank.
+def read_xls_sheet(layout, job):
+	sheet = layout["sheet"]
+	ncols = layout["ncols"]
+	columns = [(col, name) for col, name in enumerate(layout["col_names"]) if name is not None]
+	typed = job.get("typed", False)
+	for frame in range(0, layout["nframes"]):
+		for row in range(layout["firstrow"], sheet.nrows):
+			values = sheet.row_values(row, frame * ncols, (frame + 1) * ncols)
+			if typed:
+				types = sheet.row_types(row, frame * ncols, (frame + 1) * ncols)
+				values = [typed_xls_value(values[i], types[i], layout["datemode"]) for i in range(0, len(values))]
 			content = {}
 			if job["tabs"] != "":
 				content[job["tabs"]] = sheet.name
-			for col in range(0, len(col_names)):
-				if col_names[col] != "":
-					content[col_names[col]] = clean_value(sheet.cell_value(row, col + frame * ncols), True)
-			data["rows"].append(content)
+			for col, name in columns:
+				if col < len(values):
+					content[name] = clean_value(values[col], True, typed)
+				elif typed:
+					content[name] = None
+				else:
+					content[name] = ""
+			yield content
 
-	return data
+
+
+# xlrd gives dates as floats and booleans and errors as ints, so for typed
+# output we use the cell types to turn them back into what they were in Excel
+def typed_xls_value(value, ctype, datemode):
+	if ctype == xlrd.XL_CELL_EMPTY or ctype == xlrd.XL_CELL_BLANK:
+		return None
+	elif ctype == xlrd.XL_CELL_DATE:
+		try:
+			return xlrd.xldate.xldate_as_datetime(value, datemode)
+		except xlrd.xldate.XLDateError:
+			return value
+	elif ctype == xlrd.XL_CELL_BOOLEAN:
+		return bool(value)
+	elif ctype == xlrd.XL_CELL_ERROR:
+		return xlrd.error_text_from_code.get(value)
+	return value
 
 
 
 def read_xlsx(job):
 	print_with_timestamp("Processing " + job["filename"])
-	ntabs = 0
 	data = {
 		'headers': [],
-		'rows': []
+		'rows': None
 	}
-	wb = openpyxl.load_workbook(
-		job["inputfile"],
-		read_only=False,
-		keep_vba=False,
-		guess_types=True,
-		data_only=True,
-		keep_links=False
-	)
+	known_headers = set()
+	if job.get("xlsx_backend") == "fastxlsx":
+		wb = fastxlsx.load_workbook(job["inputfile"])
+	else:
+		# read-only mode streams rows out of the sheet XML instead of building the
+		# whole workbook in memory, but it doesn't know about merged cells
+		wb = openpyxl.load_workbook(
+			job["inputfile"],
+			read_only=True,
+			keep_vba=False,
+			data_only=True,
+			keep_links=False
+		)
+	merges = read_xlsx_merged_cells(job["inputfile"])
 
+	sheetnames = []
 	if job["tabs"] == "":
-		data = read_xlsx_sheet(wb[wb.get_sheet_names()[0]], data, job)
-		ntabs = 1
+		sheetnames.append(wb.sheetnames[0])
 	else:
-		data["headers"].append(job["tabs"])
-		sheets = wb.sheetnames
+		add_headers(data, known_headers, [job["tabs"]])
 		if job["skip_tabs"] == "":
 			job["skip_tabs"] = 0
-		for i in range(int(job["skip_tabs"]), len(sheets)):
-			print_if_verbose("Reading sheet: '" + sheets[i] + "'")
-			data = read_xlsx_sheet(wb[sheets[i]], data, job, sheets[i])
-			ntabs += 1
-	wb.close()
-	print_with_timestamp(str(ntabs) + " tab[s] read")
+		sheetnames = wb.sheetnames[int(job["skip_tabs"]):]
+
+	layouts = []
+	for sheetname in sheetnames:
+		layout = read_xlsx_header(wb[sheetname], job, merges.get(sheetname, []))
+		if job["tabs"] != "":
+			layout["name"] = sheetname
+		add_headers(data, known_headers, layout["col_names"])
+		layouts.append(layout)
+	data["rows"] = stream_xlsx_rows(wb, layouts, job)
 	return data
 
 
 
-def read_xlsx_sheet(sheet, data, job, sheetname=""):
+def stream_xlsx_rows(wb, layouts, job):
+	try:
+		for layout in layouts:
+			if layout["name"] != "":
+				print_if_verbose("Reading sheet: '" + layout["name"] + "'")
+			for content in read_xlsx_sheet(layout, job):
+				yield content
+	finally:
+		wb.close()
+	print_with_timestamp(str(len(layouts)) + " tab[s] read")
+
+
+
+def read_xlsx_header(sheet, job, merged_ranges=()):
 	header = int(job["header"])
 	if job["subheader"] == "":
 		subheader = None
@@ -200,6 +910,8 @@ def read_xlsx_sheet(sheet, data, job, sheetname=""):
 		subheader = int(job["subheader"])
 		firstrow = int(job["subheader"]) + 1
 
+	if sheet.max_column is None:
+		sheet.calculate_dimension(force=True) # some writers leave out the dimension tag
 	if job["column_wrap"] == "":
 		ncols = sheet.max_column
 		nframes = 1
@@ -209,66 +921,318 @@ def read_xlsx_sheet(sheet, data, job, sheetname=""):
 			nframes = sheet.max_column // ncols + 1
 		else:
 			nframes = sheet.max_column // ncols
+
+	merges = index_merged_cells(merged_ranges)
+	# merge anchors above the data still supply values to the cells they cover
+	anchor_values = {}
+	head_depth = max([header, subheader or 0] + [r for r, c in merges["anchors"] if r < firstrow])
+	head_rows = {}
+	for rownum, values in enumerate(
+			sheet.iter_rows(min_row=1, max_row=head_depth, max_col=sheet.max_column, values_only=True),
+			1
+	):
+		head_rows[rownum] = values
+		for r, c in merges["anchors"]:
+			if r == rownum:
+				anchor_values[(r, c)] = row_value(values, c - 1)
 	prev_head = ""
 	col_names = []
 
-	for col in range(1, ncols + 1): # openpyxl is 1-indexed
+	for col in range(0, ncols):
 		if subheader is None:
-			val = sheet.cell(row=header, column=col).value
+			val = row_value(head_rows.get(header), col)
 		else:
-			if sheet.cell(row=header, column=col).value != None:
-				prev_head = sheet.cell(row=header, column=col).value
-			if sheet.cell(row=subheader, column=col).value == None:
+			if row_value(head_rows.get(header), col) != None:
+				prev_head = row_value(head_rows.get(header), col)
+			if row_value(head_rows.get(subheader), col) == None:
 				val = prev_head
 			else:
-				val = prev_head + ": " + str(sheet.cell(row=subheader, column=col).value)
+				val = prev_head + ": " + str(row_value(head_rows.get(subheader), col))
 		col_names.append(val)
 
-	for val in col_names:
-		if val is not None and val not in data["headers"]:
-			data["headers"].append(val)
+	return {
+		'sheet': sheet,
+		'name': "",
+		'col_names': col_names,
+		'ncols': ncols,
+		'nframes': nframes,
+		'firstrow': firstrow,
+		'merges': merges,
+		'anchor_values': anchor_values
+	}
 
-	merge_starts = [x.split(":")[0] for x in str(sheet.merged_cells)]
 
-	for frame in range(0, nframes):
-		for rownum in range(firstrow, sheet.max_row + 1):
+
+def read_xlsx_sheet(layout, job):
+	sheet = layout["sheet"]
+	col_names = layout["col_names"]
+	ncols = layout["ncols"]
+	merges = layout["merges"]
+	anchor_values = layout["anchor_values"]
+	typed = job.get("typed", False)
+	for frame in range(0, layout["nframes"]):
+		firstcol = frame * ncols + 1 # openpyxl is 1-indexed
+		rows = sheet.iter_rows(
+				min_row=layout["firstrow"],
+				max_row=sheet.max_row,
+				min_col=firstcol,
+				max_col=firstcol + ncols - 1,
+				values_only=True
+		)
+		for rownum, values in enumerate(rows, layout["firstrow"]):
 			content = {}
 			if job["tabs"] != "":
-				content[job["tabs"]] = sheetname
+				content[job["tabs"]] = layout["name"]
 			for col in range(0, len(col_names)):
 				if col_names[col] is not None:
-					coord = sheet.cell(row=rownum, column=col+frame*ncols+1).coordinate
-					coord_above = sheet.cell(row=rownum-1, column=col+frame*ncols+1).coordinate
-					val = sheet.cell(row=rownum, column=col+frame*ncols+1).value
+					val = row_value(values, col)
 					# if we have a merged set of cells, use the first value for all of them
-					if coord in sheet.merged_cells and coord not in merge_starts:
-						val = data["rows"][-1][col_names[col]]
-					content[col_names[col]] = clean_value(val, True)
-			data["rows"].append(content)
+					if merges["ncells"] > 0:
+						anchor = merge_anchor(merges, rownum, firstcol + col)
+						if anchor == (rownum, firstcol + col):
+							anchor_values[anchor] = val
+						elif anchor is not None:
+							val = anchor_values.get(anchor)
+					content[col_names[col]] = clean_value(val, True, typed)
+			yield content
+
+
+
+# Appends any column names we haven't seen yet to data["headers"], using the
+# set known_headers so the check doesn't get slower as the header list grows
+def add_headers(data, known_headers, col_names):
+	for val in col_names:
+		if val is not None and val not in known_headers:
+			known_headers.add(val)
+			data["headers"].append(val)
+
+
+
+# Rows from openpyxl's streaming reader can be shorter than the sheet is wide
+def row_value(values, col):
+	if values is None or col >= len(values):
+		return None
+	return values[col]
+
+
+
+# Read-only worksheets don't carry their merged cell ranges, so we pull them
+# straight out of the sheet XML: {sheet name: ["A1:B2", ...]}
+def read_xlsx_merged_cells(filename):
+	merges = {}
+	with zipfile.ZipFile(filename) as archive:
+		for sheetname, path in fastxlsx.xlsx_sheet_paths(archive):
+			merges[sheetname] = fastxlsx.scan_merged_cells(archive, path)
+	return merges
+
 
-	return data
 
+# Maps every cell in a set of merged ranges to the (row, column) of its range's
+# top left "anchor" cell, anchors included. If the ranges cover no more than
+# dense_merge_limit cells that's a plain dict per cell; beyond that each
+# column gets a list of row intervals sorted for bisect, so a merge spanning
+# whole columns doesn't need millions of entries.
+def index_merged_cells(merged_ranges):
+	merges = {
+		'ncells': 0,
+		'anchors': [],
+		'cells': {},
+		'columns': {}
+	}
+	bounds = [fastxlsx.range_boundaries(ref) for ref in merged_ranges]
+	for min_col, min_row, max_col, max_row in bounds:
+		merges["ncells"] += (max_col - min_col + 1) * (max_row - min_row + 1)
+		merges["anchors"].append((min_row, min_col))
+	for min_col, min_row, max_col, max_row in bounds:
+		for col in range(min_col, max_col + 1):
+			if merges["ncells"] <= dense_merge_limit:
+				for row in range(min_row, max_row + 1):
+					merges["cells"][(row, col)] = (min_row, min_col)
+			else:
+				merges["columns"].setdefault(col, []).append((min_row, max_row, (min_row, min_col)))
+	for intervals in merges["columns"].values():
+		intervals.sort()
+	return merges
+
+
+
+def merge_anchor(merges, row, col):
+	if merges["ncells"] <= dense_merge_limit:
+		return merges["cells"].get((row, col))
+	intervals = merges["columns"].get(col)
+	if intervals is None:
+		return None
+	i = bisect.bisect_right(intervals, (row, float("inf"))) - 1
+	if i >= 0 and intervals[i][1] >= row:
+		return intervals[i][2]
+	return None
 
 
 
 
+
+def write_output(data, filename, job):
+	if job.get("output_format") == "sqlite":
+		write_sqlite(data, filename, output_table_name(job))
+	elif job.get("output_format") == "parquet":
+		write_parquet(data, filename)
+	else:
+		write_csv(data, filename)
+
+
+
+# data["rows"] can be any iterable of row dicts, including the generators from
+# read_xls() and read_xlsx(), so rows reach the disk as soon as they're read
 def write_csv(data, filename):
-	with open(filename, 'w') as outfile:
-		writer = csv.DictWriter(outfile, fieldnames=data["headers"])
+	with compressed_io.open_file(filename, 'w') as outfile:
+		writer = fast_csv.DictWriter(outfile, fieldnames=data["headers"])
 		writer.writeheader()
+		writer.writerows(data["rows"])
+
+
+
+# Loads the rows into a table of their own in an SQLite database, replacing
+# any earlier version of that table. Rows go in with executemany() in batches
+# of sqlite_batch_size, one transaction per batch, into a temporary table that
+# only replaces the real one once everything has been read. Columns are left
+# untyped so every value keeps the type it had in the workbook.
+def write_sqlite(data, filename, table):
+	columns = sqlite_columns(data["headers"])
+	partial = table + "__partial"
+	db = sqlite3.connect(filename, timeout=600) # other jobs may be writing to the same file
+	try:
+		with db:
+			db.execute("DROP TABLE IF EXISTS " + sqlite_name(partial))
+			db.execute(
+					"CREATE TABLE " + sqlite_name(partial) + " ("
+					+ ", ".join(sqlite_name(c) for c in columns) + ")"
+			)
+		insert = (
+				"INSERT INTO " + sqlite_name(partial) + " VALUES ("
+				+ ", ".join(["?"] * len(columns)) + ")"
+		)
+		batch = []
 		for row in data["rows"]:
-			writer.writerow(row)
+			batch.append([sqlite_value(row.get(h)) for h in data["headers"]])
+			if len(batch) >= sqlite_batch_size:
+				with db:
+					db.executemany(insert, batch)
+				batch = []
+		with db:
+			db.executemany(insert, batch)
+			db.execute("DROP TABLE IF EXISTS " + sqlite_name(table))
+			db.execute("ALTER TABLE " + sqlite_name(partial) + " RENAME TO " + sqlite_name(table))
+	except BaseException:
+		with db:
+			db.execute("DROP TABLE IF EXISTS " + sqlite_name(partial))
+		raise
+	finally:
+		db.close()
+
+
+
+# SQLite column names are case-insensitive, and headers can be numbers, so
+# "Total", "TOTAL" and "total", or 2015 and "2015", would be the same column.
+# Each clash after the first gets a suffix: Total, TOTAL_2, total_3.
+def sqlite_columns(headers):
+	columns = []
+	taken = set()
+	for h in headers:
+		name = str(h)
+		n = 1
+		while name.lower() in taken:
+			n += 1
+			name = str(h) + "_" + str(n)
+		taken.add(name.lower())
+		columns.append(name)
+	return columns
+
+
+
+def sqlite_name(name):
+	return '"' + name.replace('"', '""') + '"'
+
+
+
+# sqlite3 can store numbers, strings and booleans as they are, but not dates
+def sqlite_value(val):
+	if isinstance(val, (datetime.datetime, datetime.date, datetime.time)):
+		return val.isoformat(" ") if isinstance(val, datetime.datetime) else val.isoformat()
+	return val
+
+
+
+def sqlite_has_table(filename, table):
+	db = sqlite3.connect(filename, timeout=600)
+	try:
+		found = db.execute(
+				"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+		).fetchone()
+	finally:
+		db.close()
+	return found is not None
+
+
+
+# Writes a Parquet file with one typed column per header. A column whose
+# values are all of one kind (ints, floats, booleans, dates, ...) gets that
+# type; a column mixing kinds is stored as text. Unlike the other formats this
+# holds one workbook's columns in memory, since Parquet needs each column's
+# type settled before it's written.
+def write_parquet(data, filename):
+	try:
+		import pyarrow
+		import pyarrow.parquet
+	except ImportError:
+		raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+	columns = [[] for h in data["headers"]]
+	for row in data["rows"]:
+		for i in range(0, len(columns)):
+			columns[i].append(row.get(data["headers"][i]))
+	arrays = [pyarrow.array(*parquet_column(values)) for values in columns]
+	table = pyarrow.Table.from_arrays(arrays, names=[str(h) for h in data["headers"]])
+	pyarrow.parquet.write_table(table, filename)
+
+
+
+# Returns (values, pyarrow type) for one column
+def parquet_column(values):
+	import pyarrow
+	types = {
+		bool: pyarrow.bool_(),
+		int: pyarrow.int64(),
+		float: pyarrow.float64(),
+		str: pyarrow.string(),
+		datetime.datetime: pyarrow.timestamp("us"),
+		datetime.date: pyarrow.date32(),
+		datetime.time: pyarrow.time64("us")
+	}
+	kinds = set(type(v) for v in values if v is not None)
+	if kinds == set([int, float]):
+		return [None if v is None else float(v) for v in values], pyarrow.float64()
+	elif len(kinds) == 1 and kinds.issubset(types):
+		return values, types[kinds.pop()]
+	elif len(kinds) == 0:
+		return values, pyarrow.string()
+	return [None if v is None else str(v) for v in values], pyarrow.string()
 
 
 
 # "turkish" in this a special case for routine ways Turkish characters:
 # İ, Ṣ, ğ, ı & ṣ
 # get mangled
-def clean_value(val, turkish=False):
+turkish_fixes = str.maketrans({'Ý': 'İ', 'Þ': 'Ş', 'ð': 'ğ', 'ý': 'ı', 'þ': 'ş'})
+
+# With typed=True, values other than strings are left as they are
+def clean_value(val, turkish=False, typed=False):
 	if val is None:
+		if typed:
+			return None
 		return ""
+	elif typed and not isinstance(val, str):
+		return val
 	elif turkish:
-		return str(val).replace('Ý','İ').replace('Þ', 'Ş').replace('ð','ğ').replace('ý', 'ı').replace('þ', 'ş')
+		return str(val).translate(turkish_fixes)
 	else:
 		return val
 
@@ -282,6 +1246,19 @@ def get_args():
 # positional argument
 	parser.add_argument("joblist", help="required argument: list of files to process with some metadata described in comments at the top of the script.")
 
+# optional arguments
+	parser.add_argument("-j", "--jobs", help="number of workbooks to flatten at once, each in its own process. Default is 1.", type=int, default=1)
+	parser.add_argument("-f", "--force", help="flatten every workbook in the list, even those that haven't changed since the last run.", action="store_true")
+	parser.add_argument("--hash", help="decide whether a workbook has changed by its contents (SHA-1) rather than its modification time.", action="store_true")
+	parser.add_argument("-m", "--merge", help="after flattening, combine all the flattened CSVs into one file with the union of their columns and a " + merge_source_column + " column, written next to the job list as <joblist>_merged.csv.", action="store_true")
+	parser.add_argument("-z", "--compress", help="compress the CSV output (including the merged file) with gzip, bzip2, xz or zstandard. zst needs the zstandard module installed.", choices=["gz", "bz2", "xz", "zst"])
+	parser.add_argument("-o", "--output-format", help="csv (default); sqlite, for one database with a table per workbook; or parquet, for typed columnar files. The last two keep numbers, dates and booleans as such instead of turning everything into text. parquet needs pyarrow installed.", choices=["csv", "sqlite", "parquet"], default="csv")
+	parser.add_argument("--xlsx-backend", help="library for reading .xlsx files: openpyxl (default) or fastxlsx, which parses the XML directly and is several times faster.", choices=["openpyxl", "fastxlsx"], default="openpyxl")
+	parser.add_argument("-w", "--watch", help="keep running, and re-flatten workbooks whenever they or the job list change, until stopped with Ctrl-C. Its status is kept in " + status_filename + " in the output directory.", action="store_true")
+	parser.add_argument("--poll-interval", help="with --watch: seconds between checks for changes. Default is 2.", type=float, default=2.0, metavar="SECONDS")
+	parser.add_argument("--debounce", help="with --watch: seconds to wait after the last change before flattening, so a burst of changes is handled in one go. Default is 5.", type=float, default=5.0, metavar="SECONDS")
+	instrumentation.add_arguments(parser)
+
 	args = parser.parse_args()
 	return args
 
@@ -306,7 +1283,11 @@ def print_with_timestamp(msg):
 
 
 def elapsed_time(starttime):
-	seconds = time.time() - starttime
+	return format_duration(time.time() - starttime)
+
+
+
+def format_duration(seconds):
 	if seconds < 1:
 		return "less than one second"
 	hours = int(seconds / 60 / 60)
@@ -0,0 +1,246 @@
+#! /usr/bin/env python3
+
+# Makes synthetic multi-tab workbooks, with a job list to flatten them, for
+# testing and benchmarking flatten.py.
+# http://eldan.co.uk/ ~ @eldang ~ eldang@gmail.com
+#
+# Usage: generate_workbooks.py path/to/output_dir
+# writes synthetic_xlsx_1.xlsx, synthetic_xls_1.xls, ... and a jobs.csv listing
+# them all into output_dir, so then: flatten.py path/to/output_dir/jobs.csv
+#
+# Each tab has --title-rows of title text, a header row, optionally a
+# subheader row, and then --rows rows of data: a mix of number, text and date
+# columns with some blank cells. With --subheader, each header spans two
+# columns (merged, in .xlsx), in the "Region: Name", "Region: Code" style.
+# --merges adds that many vertically merged ranges to the data of each tab.
+# --column-wrap N lays the data out as N blocks of --columns columns side by
+# side, with the job list's column_wrap set to match.
+#
+# .xlsx files need openpyxl, which flatten.py uses anyway. .xls files need
+# xlwt: pip install xlwt. Merged ranges are only written to .xlsx files,
+# since flatten.py doesn't read them from .xls files.
+
+import argparse
+import csv
+import datetime
+import os
+import random
+import sys
+import time
+
+import openpyxl
+
+
+# xlwt can't write more than this to a .xls sheet
+xls_max_rows = 65536
+xls_max_cols = 256
+
+job_fields = ["filename", "header", "subheader", "tabs", "skip_tabs", "column_wrap", "special_handling", "notes"]
+column_kinds = ["number", "decimal", "text", "date"]
+
+
+
+
+def main():
+	args = get_args()
+	print_with_timestamp("Starting run.")
+	if not os.path.isdir(args.output_dir):
+		os.makedirs(args.output_dir)
+	if args.format == "both":
+		formats = ["xlsx", "xls"]
+	else:
+		formats = [args.format]
+
+	jobs = []
+	for n in range(1, args.workbooks + 1):
+		for fmt in formats:
+			filename = "synthetic_" + fmt + "_" + str(n) + "." + fmt # flatten.py gives x.xls and x.xlsx the same output file
+			print_with_timestamp("Writing " + filename)
+			book = make_workbook(args, random.Random(args.seed * 1000 + n))
+			if fmt == "xlsx":
+				write_xlsx(book, os.path.join(args.output_dir, filename))
+			else:
+				write_xls(book, os.path.join(args.output_dir, filename))
+			jobs.append(job_for(book, filename, args))
+
+	joblist = os.path.join(args.output_dir, "jobs.csv")
+	with open(joblist, 'w', newline="") as jobsfile:
+		writer = csv.DictWriter(jobsfile, fieldnames=job_fields)
+		writer.writeheader()
+		writer.writerows(jobs)
+	print_with_timestamp("Run complete. Job list written to " + joblist)
+
+
+
+
+# Lays out a workbook as plain Python data, so that the same contents can be
+# written to either format. Returns a dict of:
+# 'tabs': a list of tabs, each a dict of 'name', 'rows' (lists of cell
+#	values, None for blank) and 'merges' ((first row, first col, last row,
+#	last col), 1-indexed like Excel)
+# 'header' and 'subheader': row numbers, 1-indexed; subheader is None if
+#	there isn't one
+def make_workbook(args, rng):
+	header = args.title_rows + 1
+	subheader = header + 1 if args.subheader else None
+	firstrow = (subheader or header) + 1
+	kinds = [column_kinds[col % len(column_kinds)] for col in range(0, args.columns)]
+
+	head_rows = make_head_rows(args.columns, args.subheader)
+	tabs = []
+	for t in range(0, args.tabs):
+		rows = [["Synthetic workbook, tab " + str(t + 1)]]
+		rows += [[] for i in range(1, args.title_rows)]
+		merges = []
+		for head_row in head_rows:
+			rows.append(head_row * args.column_wrap)
+		if args.subheader:
+			for frame in range(0, args.column_wrap):
+				for col in range(0, args.columns - 1, 2):
+					first = frame * args.columns + col + 1
+					merges.append((header, first, header, first + 1))
+		for r in range(0, args.rows):
+			row = []
+			for frame in range(0, args.column_wrap):
+				row += [make_value(rng, kind) for kind in kinds]
+			rows.append(row)
+		for i in range(0, args.merges):
+			col = rng.randrange(0, args.columns * args.column_wrap) + 1
+			first = rng.randrange(firstrow, firstrow + max(args.rows - 5, 1))
+			# skip any that would overlap an existing merge
+			if not any(m[1] <= col <= m[3] and m[0] - 5 <= first <= m[2] for m in merges):
+				merges.append((first, col, min(first + rng.randrange(1, 5), firstrow + args.rows - 1), col))
+		tabs.append({
+			'name': str(2000 + t),
+			'rows': rows,
+			'merges': [m for m in merges if m[2] > m[0] or m[3] > m[1]]
+		})
+	return {'tabs': tabs, 'header': header, 'subheader': subheader}
+
+
+
+# Returns the header row, plus the subheader row if there is one. With a
+# subheader, each header covers two columns, and only its first cell is set.
+def make_head_rows(columns, subheader):
+	if not subheader:
+		return [["Column " + str(col + 1) for col in range(0, columns)]]
+	headers = []
+	subheaders = []
+	for col in range(0, columns):
+		if col % 2 == 0:
+			headers.append("Group " + str(col // 2 + 1))
+		else:
+			headers.append(None)
+		subheaders.append(["Name", "Value"][col % 2] + " " + str(col + 1))
+	return [headers, subheaders]
+
+
+
+def make_value(rng, kind):
+	if rng.random() < 0.05:
+		return None
+	elif kind == "number":
+		return rng.randrange(0, 100000)
+	elif kind == "decimal":
+		return round(rng.random() * 1000, 3)
+	elif kind == "text":
+		return "item " + str(rng.randrange(0, 1000)) + rng.choice(["", " ı", " Ş", " é"])
+	return datetime.datetime(2015, 1, 1) + datetime.timedelta(days=rng.randrange(0, 3650))
+
+
+
+def write_xlsx(book, filename):
+	if any(len(tab["merges"]) > 0 for tab in book["tabs"]):
+		wb = openpyxl.Workbook()
+		wb.remove(wb.active)
+		for tab in book["tabs"]:
+			ws = wb.create_sheet(tab["name"])
+			for r, row in enumerate(tab["rows"], 1):
+				for c, value in enumerate(row, 1):
+					if value is not None:
+						ws.cell(row=r, column=c, value=value)
+			for first_row, first_col, last_row, last_col in tab["merges"]:
+				ws.merge_cells(
+						start_row=first_row, start_column=first_col,
+						end_row=last_row, end_column=last_col
+				)
+	else:
+		# write-only mode is much faster, but can't merge cells
+		wb = openpyxl.Workbook(write_only=True)
+		for tab in book["tabs"]:
+			ws = wb.create_sheet(tab["name"])
+			for row in tab["rows"]:
+				ws.append(row)
+	wb.save(filename)
+
+
+
+def write_xls(book, filename):
+	try:
+		import xlwt
+	except ImportError:
+		sys.exit("Writing .xls files needs xlwt: pip install xlwt")
+	dateformat = xlwt.easyxf(num_format_str="yyyy-mm-dd")
+	wb = xlwt.Workbook(encoding="utf-8")
+	for tab in book["tabs"]:
+		if len(tab["rows"]) > xls_max_rows or max(len(row) for row in tab["rows"]) > xls_max_cols:
+			sys.exit(".xls sheets can't be bigger than " + str(xls_max_rows) + " rows by " + str(xls_max_cols) + " columns")
+		ws = wb.add_sheet(tab["name"])
+		for r, row in enumerate(tab["rows"]):
+			for c, value in enumerate(row):
+				if isinstance(value, datetime.datetime):
+					ws.write(r, c, value, dateformat)
+				elif value is not None:
+					ws.write(r, c, value)
+	wb.save(filename)
+
+
+
+def job_for(book, filename, args):
+	if args.column_wrap > 1:
+		column_wrap = str(args.columns)
+	else:
+		column_wrap = ""
+	return {
+		'filename': filename,
+		'header': str(book["header"]),
+		'subheader': str(book["subheader"] or ""),
+		'tabs': "Year",
+		'skip_tabs': "",
+		'column_wrap': column_wrap,
+		'special_handling': "",
+		'notes': "synthetic"
+	}
+
+
+
+def print_with_timestamp(msg):
+	print(time.ctime() + ": " + str(msg))
+	sys.stdout.flush()
+
+
+
+def get_args():
+	parser = argparse.ArgumentParser(description="Make synthetic tabbed Excel files, and a job list for them, to test and benchmark flatten.py")
+
+# positional argument
+	parser.add_argument("output_dir", help="required argument: directory to write the workbooks and jobs.csv into. It will be created if need be, and files in it with the same names overwritten.")
+
+# optional arguments
+	parser.add_argument("--format", help="xlsx, xls, or both (default), to write each workbook in both formats.", choices=["xlsx", "xls", "both"], default="both")
+	parser.add_argument("-w", "--workbooks", help="number of workbooks to make. Default is 1.", type=int, default=1)
+	parser.add_argument("-t", "--tabs", help="number of tabs in each workbook. Default is 3.", type=int, default=3)
+	parser.add_argument("-r", "--rows", help="number of data rows in each tab. Default is 1000.", type=int, default=1000)
+	parser.add_argument("-c", "--columns", help="number of data columns (per block, with --column-wrap). Default is 8.", type=int, default=8)
+	parser.add_argument("--title-rows", help="number of rows above the header. Default is 1.", type=int, default=1)
+	parser.add_argument("--subheader", help="add a subheader row, with each header covering two columns.", action="store_true")
+	parser.add_argument("--merges", help="number of vertically merged ranges to add to each tab's data (.xlsx only). Default is 0.", type=int, default=0)
+	parser.add_argument("--column-wrap", help="number of blocks of columns to lay the data out in, side by side. Default is 1.", type=int, default=1)
+	parser.add_argument("--seed", help="random seed, so the same options always make the same workbooks. Default is 1.", type=int, default=1)
+
+	return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+	main()
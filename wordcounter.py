@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+
+# Word frequency counter for Wordle input, the front end to wordlefeeder.py
+
+# This program is free software; you can redistribute it and/or
+#		modify it under the terms of the GNU General Public License
+#		as published by the Free Software Foundation; either version 2
+#		of the License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+#		but WITHOUT ANY WARRANTY; without even the implied warranty of
+#		MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#		GNU General Public License for more details.
+# The licence text is available online at:
+#		http://www.gnu.org/licenses/gpl-2.0.html
+
+# This program is the front end to wordlefeeder.py. It takes a directory of
+# text files, splits them into words, and counts how often each word appears.
+# Words are normalised the same way wordlefeeder.py does it, so "the", "The"
+# and "THE" are all counted as "The".
+#
+# By default the output is a CSV in exactly the format wordlefeeder.py reads:
+# a header row, words in the first column and counts in the second. With
+# --per-file there is one count column per input file instead, named after
+# its path relative to input_dir (without the extension).
+# With --wordle the counts skip the CSV stage altogether and go straight into
+# one Wordle-ready [column header].txt file per column.
+#
+# Large files are split into chunks and all the chunks are tokenised in
+# parallel, one process per core unless --processes says otherwise.
+# --metrics FILE writes progress and a summary as JSON lines, and --profile
+# FILE saves cProfile stats: see instrumentation.py.
+#
+# Example:
+#		./wordcounter.py path/to/texts frequencies.csv --top 500
+#		./wordlefeeder.py frequencies.csv
+
+import argparse
+import collections
+import csv
+import heapq
+import multiprocessing
+import operator
+import os
+import re
+import sys
+
+import instrumentation
+import wordlefeeder
+
+
+# Files bigger than this are tokenised in several pieces, so one huge file
+# doesn't leave the other processes idle
+chunk_size = 1 << 26
+
+word_pattern = re.compile(r"[\w']+", re.UNICODE)
+
+
+
+def main():
+	args = get_args()
+	verbose = args.verbose
+
+	files = find_text_files(args.input_dir)
+	if len(files) == 0:
+		sys.exit("Error: no files found in " + args.input_dir)
+	if args.per_file:
+		column_names = [os.path.splitext(os.path.relpath(f, args.input_dir))[0] for f in files]
+	else:
+		column_names = [os.path.basename(os.path.abspath(args.input_dir))]
+	if verbose: print "Counting words in", len(files), "files"
+
+	with instrumentation.run("wordcounter", args) as metrics:
+		with metrics.stage("count"):
+			counts = count_words(files, args.per_file, args.processes, metrics)
+		with metrics.stage("rank"):
+			words = ranked_words(counts, args.top)
+		if verbose: print len(words), "distinct words to write"
+
+		with metrics.stage("write"):
+			if args.wordle:
+				write_wordle_files(words, counts, column_names, args.scale, verbose)
+			else:
+				write_frequency_csv(words, counts, column_names, args.output)
+				if verbose: print "Frequencies written to", args.output
+		metrics.add("distinct_words", len(words))
+
+
+
+def find_text_files(input_dir):
+	files = []
+	for dirname, subdirs, filenames in os.walk(input_dir):
+		subdirs.sort()
+		for fname in sorted(filenames):
+			if not fname.startswith('.'):
+				files.append(os.path.join(dirname, fname))
+	return files
+
+
+
+# Splits every file into (column, filename, start, end) byte ranges of at most
+# chunk_size bytes, which are the units of work handed to the process pool
+def make_chunks(files, per_file):
+	chunks = []
+	for i in range(0, len(files), 1):
+		if per_file:
+			column = i
+		else:
+			column = 0
+		size = os.path.getsize(files[i])
+		for start in xrange(0, max(size, 1), chunk_size):
+			chunks.append((column, files[i], start, min(start + chunk_size, size)))
+	return chunks
+
+
+
+def count_words(files, per_file, processes=None, metrics=None):
+	if metrics is None:
+		metrics = instrumentation.Metrics("wordcounter")
+	if per_file:
+		ncols = len(files)
+	else:
+		ncols = 1
+	counts = [collections.Counter() for i in range(0, ncols, 1)]
+	pool = multiprocessing.Pool(processes)
+	try:
+		for column, chunk_counts, nbytes in pool.imap_unordered(count_chunk, make_chunks(files, per_file)):
+			counts[column].update(chunk_counts)
+			metrics.add("chunks")
+			metrics.add("input_bytes", nbytes)
+	finally:
+		pool.close()
+		pool.join()
+	return counts
+
+
+
+# Counts the words in the lines that start within [start, end) of one file.
+# A line that straddles a chunk boundary belongs to the chunk it starts in.
+# Returns the chunk's size along with its counts, for progress metrics.
+def count_chunk(chunk):
+	column, filename, start, end = chunk
+	counts = collections.Counter()
+	with open(filename, 'rb') as f_in:
+		if start > 0:
+			f_in.seek(start - 1)
+			f_in.readline() # finish off the line that the previous chunk owns
+		while f_in.tell() < end:
+			line = f_in.readline()
+			if line == "":
+				break
+			for word in word_pattern.findall(line.decode('utf-8', 'replace')):
+				counts[wordlefeeder.clean_word(word)] += 1
+	return column, counts, end - start
+
+
+
+# Words in descending order of total count (ties alphabetically), cut down to
+# the top n if asked. heapq saves sorting every word just to keep n of them,
+# but the merged totals of every word are still built first, so top doesn't
+# bound memory use: that's set by the number of distinct words.
+def ranked_words(counts, top=None):
+	if len(counts) == 1:
+		totals = counts[0]
+	else:
+		totals = collections.Counter()
+		for column in counts:
+			totals.update(column)
+	sort_key = lambda item: (-item[1], item[0])
+	if top is None:
+		ranked = sorted(totals.iteritems(), key=sort_key)
+	else:
+		ranked = heapq.nsmallest(top, totals.iteritems(), key=sort_key)
+	return [word for word, total in ranked]
+
+
+
+def write_frequency_csv(words, counts, column_names, filename):
+	with open(filename, 'wb') as f_out:
+		writer = csv.writer(f_out)
+		writer.writerow(["word"] + [utf8_name(name) for name in column_names])
+		for word in words:
+			writer.writerow([word.encode('utf-8')] + [column[word] for column in counts])
+
+
+
+# Column names come from file and directory names, which are already byte
+# strings, so they're written as they are (which on any UTF-8 filesystem is
+# UTF-8, like the words). Encoding them again would decode them as ASCII first.
+def utf8_name(name):
+	if isinstance(name, unicode):
+		return name.encode('utf-8')
+	return name
+
+
+
+# Does wordlefeeder's job directly from the counts, without a CSV in between.
+# With --per-file, files from subdirectories of input_dir get matching
+# subdirectories here.
+def write_wordle_files(words, counts, column_names, scale, verbose):
+	if scale is None:
+		factors = [1.0] * len(counts)
+	else:
+		totals = [sum(column[word] for word in words) for column in counts]
+		factors = wordlefeeder.scale_factors(totals, scale)
+	for i in range(0, len(counts), 1):
+		name = column_names[i] + ".txt"
+		if os.path.dirname(name) != "" and not os.path.isdir(os.path.dirname(name)):
+			os.makedirs(os.path.dirname(name))
+		with open(name, 'w', wordlefeeder.write_block_size) as f_out:
+			for word in words:
+				n = wordlefeeder.scaled_count(counts[i][word], factors[i])
+				wordlefeeder.write_repetitions(f_out, word.encode('utf-8'), n)
+		if verbose: print name, "written"
+
+
+
+def get_args():
+	parser = argparse.ArgumentParser(description="Count word frequencies in a directory of text files, for wordlefeeder.py or Wordle itself.")
+
+# positional arguments
+	parser.add_argument("input_dir", help="required argument: directory containing the text files to count. Subdirectories are included.")
+	parser.add_argument("output", help="the frequency CSV to write. If this file already exists it will be overwritten. Not needed with --wordle.", nargs='?', default="frequencies.csv")
+
+# optional arguments
+	parser.add_argument("--verbose", help="print progress information as we go.", action="store_true")
+	parser.add_argument("--per-file", help="one count column per input file, instead of one for the whole directory.", action="store_true")
+	parser.add_argument("--top", help="only write the N most frequent words.", type=int, metavar="N")
+	parser.add_argument("--processes", help="number of worker processes. Default is one per CPU core.", type=int, metavar="N")
+	parser.add_argument("--wordle", help="write Wordle input files directly instead of a frequency CSV.", action="store_true")
+	parser.add_argument("--scale", help="with --wordle: scale each column so that its output file contains roughly this many words in total.", type=int, metavar="N")
+	instrumentation.add_arguments(parser)
+
+	return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+	main()
@@ -25,65 +25,157 @@
 # where n is the number from the corresponding column.
 # Each file is named [column header].txt .
 # Non-integer values are simply rounded off.
+# The input CSV can be compressed (.gz, .bz2, .xz or .zst): see compressed_io.py.
 #
 # Doing this allows me to feed the output files into Wordle.net
 # to visualise the word frequencies.
+#
+# Counts in real frequency tables can run into the millions, which makes for
+# enormous output files. Use --scale N to shrink (or grow) each column so its
+# output file holds roughly N words in total, with every word keeping its
+# share of the column.
+#
+# --metrics FILE writes progress and a summary as JSON lines, and --profile
+# FILE saves cProfile stats: see instrumentation.py.
 
+import argparse
 import sys
 import csv
 import string
 
-# Check command line arguments
-# File name and
-# 	optional --verbose argument. You'll get more feedback if you use that.
-if len(sys.argv) == 3:
-	verbose = True
-	if sys.argv[1] == "--verbose": input_filename = sys.argv[2]
-	elif sys.argv[2] == "--verbose": input_filename = sys.argv[1]
-	else:	sys.exit("Error: unexpected command line arguments. " \
-		"The only arguments should be a filename and optionally the --verbose switch.")
-elif len(sys.argv) == 2:
-	# then default to non-verbose
-	verbose = False
-	input_filename = sys.argv[1]
-else:
-	sys.exit("Error: unexpected command line arguments. " \
-		"The only arguments should be a filename and optionally the --verbose switch.")
-
-# Load input file
-if verbose: print "Opening:", input_filename
-with open(input_filename, 'rU') as f_in:
-	dialect = csv.Sniffer().sniff(f_in.read(1024))
-	f_in.seek(0)
-	reader = csv.reader(f_in, dialect)
-
-	# Count columns and make list of output files from the header row
-	output_filenames = reader.next()[1:]
-	if verbose: print "Making the following output files:", output_filenames
-
-	# Open all the output files we'll be needing
-	f_outs = [0]
-	for i in range(0, len(output_filenames), 1):
-		name = output_filenames[i]+".txt"
-		f_outs.append(open(name, 'w'))
-		if verbose: print name, "opened for output"
-
-	# Go through the rest of the rows
+import compressed_io # reads .gz, .bz2, .xz and .zst input transparently
+import instrumentation # --metrics and --profile
+
+
+# Repetitions are written out in blocks of about this many bytes, so a word
+# with a huge count costs a handful of write() calls rather than one per copy.
+write_block_size = 1 << 16
+
+
+
+def main():
+	args = get_args()
+	verbose = args.verbose
+	input_filename = args.input_file
+
+	with instrumentation.run("wordlefeeder", args) as metrics:
+		# Load input file
+		if verbose: print "Opening:", input_filename
+		with compressed_io.open_file(input_filename, 'rU') as f_in:
+			dialect = csv.Sniffer().sniff(f_in.read(1024))
+			f_in.seek(0)
+			reader = csv.reader(f_in, dialect)
+
+			# Count columns and make list of output files from the header row
+			output_filenames = reader.next()[1:]
+			if verbose: print "Making the following output files:", output_filenames
+
+			# If we're scaling, we need each column's total before writing anything
+			if args.scale is None:
+				factors = [1.0] * len(output_filenames)
+			else:
+				with metrics.stage("scale"):
+					totals = column_totals(reader, len(output_filenames))
+				if verbose: print "Column totals:", totals
+				factors = scale_factors(totals, args.scale)
+				f_in.seek(0)
+				reader = csv.reader(f_in, dialect)
+				reader.next()
+
+			# Open all the output files we'll be needing
+			f_outs = []
+			for name in output_filenames:
+				f_outs.append(open(name + ".txt", 'w', write_block_size))
+				if verbose: print name + ".txt", "opened for output"
+
+			# Go through the rest of the rows
+			with metrics.stage("write"):
+				for row in reader:
+					metrics.add("rows")
+					word = clean_word(row[0])
+					# for each other column, output to the relevant file as n repetitions of word
+					for i in range(0, len(f_outs), 1):
+						n = scaled_count(row[i+1], factors[i])
+						write_repetitions(f_outs[i], word, n)
+						metrics.add("words", n)
+
+			# Close files and we're done!
+			if verbose: print "Finished parsing file and writing output."
+			for f_out in f_outs:
+				f_out.close()
+			if verbose: print "Files closed. Exiting."
+		metrics.add_file_size("input_bytes", input_filename)
+
+
+
+def clean_word(word):
+	# If the "word" is actually a phrase, capitalise the individual words ...
+	word = string.capwords(word)
+	# ...and remove spaces so Wordle counts it as a whole.
+	return word.replace(" ", "")
+
+
+
+# Non-integer values are rounded off, and anything below zero counts as zero
+def scaled_count(value, factor=1.0):
+	return max(0, int(round(float(value) * factor)))
+
+
+
+def column_totals(reader, ncols):
+	totals = [0.0] * ncols
 	for row in reader:
-		# read first column as word
-		word = row[0]
-		# If the "word" is actually a phrase, capitalise the individual words ...
-		word = string.capwords(word)
-		# ...and remove spaces so Wordle counts it as a whole.
-		word = word.replace(" ", "")
-		# for each other column, output to the relevant file as n repetitions of word
-		for i in range(1, len(f_outs), 1):
-			for j in range(0, int(round(float(row[i]))), 1):
-				f_outs[i].write(word+" ")
-			f_outs[i].write("\n")
-
-	# Close files and we're done!
-	if verbose: print "Finished parsing file and writing output."
-	for i in range(1, len(f_outs), 1):
-		f_outs[i].close()
-	if verbose: print "Files closed. Exiting."
+		for i in range(0, ncols, 1):
+			totals[i] += max(0.0, float(row[i+1]))
+	return totals
+
+
+
+# One multiplier per column, mapping that column's total onto the target size
+def scale_factors(totals, target):
+	factors = []
+	for total in totals:
+		if total > 0:
+			factors.append(float(target) / total)
+		else:
+			factors.append(0.0)
+	return factors
+
+
+
+# Generates the text for one output line: n copies of the word, in blocks of
+# roughly write_block_size bytes, followed by a newline.
+def repetition_blocks(word, n, block_size=write_block_size):
+	token = word + " "
+	per_block = max(1, block_size // len(token))
+	full_blocks, remainder = divmod(n, per_block)
+	if full_blocks > 0:
+		block = token * per_block
+		for i in xrange(0, full_blocks, 1):
+			yield block
+	yield token * remainder + "\n"
+
+
+
+def write_repetitions(f_out, word, n):
+	f_out.writelines(repetition_blocks(word, n))
+
+
+
+def get_args():
+	parser = argparse.ArgumentParser(description="Make Wordle input files out of a CSV of word frequencies.")
+
+# positional argument
+	parser.add_argument("input_file", help="required argument: CSV with words in the first column and one or more columns of counts.")
+
+# optional arguments
+	parser.add_argument("--verbose", help="print progress information as we go.", action="store_true")
+	parser.add_argument("--scale", help="scale each column's counts so that its output file contains roughly this many words in total, keeping their proportions.", type=int, metavar="N")
+	instrumentation.add_arguments(parser)
+
+	return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+	main()